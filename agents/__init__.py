@@ -1,13 +1,21 @@
 from .base_agent import BaseAgent
 from .personal_assistant import PersonalAssistantAgent
-from .calendar_agent import CalendarAgent
 from .search_agent import SearchAgent
 from .code_assistant import CodeAssistantAgent
 
 __all__ = [
     'BaseAgent',
-    'PersonalAssistantAgent', 
+    'PersonalAssistantAgent',
     'CalendarAgent',
     'SearchAgent',
     'CodeAssistantAgent'
 ]
+
+
+def __getattr__(name):
+    # CalendarAgent pulls in SQLAlchemy, the models and the Flask app, so it is
+    # only imported when first requested
+    if name == 'CalendarAgent':
+        from .calendar_agent import CalendarAgent
+        return CalendarAgent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,110 @@
 import logging
+import re
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterable, AsyncIterator, Hashable, List, Optional, Sequence, Tuple
+from datetime import datetime, timedelta
+import config
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# (epoch second, formatted "YYYY-MM-DDTHH:MM:SS") for the last second seen
+_timestamp_prefix = (0, "")
+
+
+def utc_now_iso() -> str:
+    """
+    Return the current UTC time in ISO 8601 format with microseconds.
+    
+    Equivalent to datetime.utcnow().isoformat(), but the date/time part is
+    formatted at most once per second and only the microseconds are
+    formatted per call.
+    """
+    global _timestamp_prefix
+    now = time.time()
+    second = int(now)
+    cached_second, prefix = _timestamp_prefix
+    if cached_second != second:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        _timestamp_prefix = (second, prefix)
+    return f"{prefix}.{int((now - second) * 1_000_000):06d}"
+
+
+def normalize_task(task: str) -> str:
+    """Normalize a task string so trivially different phrasings share a cache key"""
+    return _WHITESPACE_RE.sub(" ", task.lower()).strip().rstrip("?.!")
+
+
+_WORD_RE = re.compile(r"[a-z0-9+#]+")
+
+# Politeness and filler words that never change what a request is asking for
+_FILLER_WORDS = frozenset((
+    'a', 'an', 'the', 'please', 'pls', 'me', 'for', 'i', 'can', 'could', 'would',
+    'you', 'kindly', 'just', 'hey', 'hi', 'hello', 'thanks', 'thank', 'some'
+))
+
+
+def routing_key(task: str) -> tuple:
+    """
+    Reduce a task to the words that matter for classifying it.
+    
+    Lowercases, drops punctuation and filler words but keeps word order, so
+    "Please book a flight for me" and "book me a flight" share a key while
+    "convert java to python" and "convert python to java" do not.
+    """
+    return tuple(word for word in _WORD_RE.findall(task.lower()) if word not in _FILLER_WORDS)
+
+
+class ResponseCache:
+    """
+    Small in-process TTL + LRU cache for LLM analysis results.
+    
+    Agents use this to skip repeated Bedrock round-trips for requests they
+    have already analyzed. Keys are any hashable value (typically built from
+    normalize_task()); entries expire after `ttl` and the least recently used
+    entry is evicted once `max_entries` is reached. Access is guarded by a
+    lock because agents are shared across request threads.
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl: timedelta = timedelta(hours=24)):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= datetime.utcnow():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def add(self, key: Hashable, value: Any, ttl: Optional[timedelta] = None):
+        """Store value under key, evicting the least recently used entry if full
+        
+        ttl overrides the cache-wide lifetime for this entry only.
+        """
+        with self._lock:
+            self._entries[key] = (datetime.utcnow() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
 
 class BaseAgent(ABC):
     """
@@ -34,6 +137,12 @@ class BaseAgent(ABC):
     - Error Handling: Graceful error handling with structured error responses
     """
     
+    # Upper bound on prior conversation messages forwarded to the LLM
+    MAX_HISTORY_MESSAGES = config.CONFIG.MAX_HISTORY_MESSAGES
+    
+    # Static capability descriptions, readable without building the agent
+    CAPABILITIES: Tuple[str, ...] = ()
+    
     def __init__(self, agent_type: str, bedrock_service, tools_service=None):
         """
         Initialize base agent with required services and configuration.
@@ -47,6 +156,8 @@ class BaseAgent(ABC):
         self.bedrock_service = bedrock_service
         self.tools_service = tools_service
         self.logger = logging.getLogger(f"agents.{agent_type}")
+        self._system_prompt: Optional[str] = None
+        self._system_prompt_blocks: Optional[List[Dict[str, Any]]] = None
         
     @abstractmethod
     def get_system_prompt(self) -> str:
@@ -107,14 +218,55 @@ class BaseAgent(ABC):
     
     def get_capabilities(self) -> List[str]:
         """Return a list of capabilities this agent provides"""
-        return []
+        return list(self.CAPABILITIES)
+    
+    @classmethod
+    def compile_keywords(cls, keywords) -> re.Pattern:
+        """
+        Compile a keyword collection into a single case-insensitive regex.
+        
+        The resulting pattern matches if any keyword occurs as a substring,
+        mirroring `any(k in text.lower() for k in keywords)` but scanning the
+        text once in C instead of once per keyword.
+        """
+        # Longest first so overlapping alternatives prefer the full phrase
+        ordered = sorted(set(keywords), key=lambda k: (-len(k), k))
+        return re.compile("|".join(map(re.escape, ordered)), re.IGNORECASE)
+    
+    @property
+    def system_prompt(self) -> str:
+        """The system prompt, built once via get_system_prompt() and reused"""
+        if self._system_prompt is None:
+            self._system_prompt = self.get_system_prompt()
+        return self._system_prompt
+    
+    def get_system_prompt_blocks(self) -> List[Dict[str, Any]]:
+        """
+        Return the system prompt as Bedrock content blocks marked for prompt caching.
+        
+        The blocks are built lazily on first use and reused afterwards, so the
+        static system prompt becomes a stable, cacheable prefix for every call.
+        Call invalidate_system_prompt() if the prompt content changes.
+        """
+        if self._system_prompt_blocks is None:
+            self._system_prompt_blocks = [{
+                "type": "text",
+                "text": self.system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }]
+        return self._system_prompt_blocks
+    
+    def invalidate_system_prompt(self):
+        """Discard the cached system prompt so it is rebuilt on next use"""
+        self._system_prompt = None
+        self._system_prompt_blocks = None
     
     def format_response(self, content: str, additional_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Format the agent's response in a standard way"""
         response = {
             'agent_type': self.agent_type,
             'content': content,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': utc_now_iso(),
             'success': True
         }
         
@@ -129,25 +281,104 @@ class BaseAgent(ABC):
             'agent_type': self.agent_type,
             'content': f"Error: {error_message}",
             'error_type': error_type,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': utc_now_iso(),
             'success': False
         }
     
-    async def generate_response(self, messages: List[Dict[str, str]], max_tokens: int = 1000) -> str:
-        """Generate a response using the bedrock service"""
+    def build_messages(self, context: Dict[str, Any], content: Any) -> List[Dict[str, Any]]:
+        """
+        Return the conversation history from context with a new user turn appended.
+        
+        context['messages'] is treated as read-only so concurrent tasks sharing a
+        context never see each other's turns. History is bounded to the last
+        MAX_HISTORY_MESSAGES entries to cap the tokens sent to Bedrock.
+        """
+        history: Sequence[Dict[str, Any]] = context.get('messages') or ()
+        if len(history) > self.MAX_HISTORY_MESSAGES:
+            history = history[-self.MAX_HISTORY_MESSAGES:]
+            # The trimmed window must still open with a user turn
+            start = 0
+            while start < len(history) and history[start].get('role') != 'user':
+                start += 1
+            history = history[start:]
+        messages = [*history, {"role": "user", "content": content}]
+        
+        # Fold the rolling summary of older turns into the first user message;
+        # Bedrock only accepts user/assistant roles inside messages
+        summary = (context.get('global_context') or {}).get('conversation_summary')
+        if summary and isinstance(messages[0].get('content'), str):
+            messages[0] = {
+                "role": "user",
+                "content": f"(Summary of the earlier conversation: {summary})\n\n{messages[0]['content']}"
+            }
+        return messages
+    
+    @staticmethod
+    def estimate_tokens(messages: Sequence[Dict[str, Any]]) -> int:
+        """Rough token count for messages (about 4 characters per token)"""
+        return sum(len(str(message.get('content', ''))) for message in messages) // 4
+    
+    async def generate_response(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 1000,
+        system_prompt_blocks: Optional[List[Dict[str, Any]]] = None,
+        temperature: float = 0.1
+    ) -> str:
+        """Generate a response using the bedrock service
+        
+        system_prompt_blocks replaces the agent's cached system blocks for this
+        call; keep such overrides constant so they stay prompt-cacheable.
+        temperature=0 asks for a repeatable answer, which BedrockService may
+        serve from its response cache (BEDROCK_RESPONSE_CACHE_TTL).
+        """
         try:
-            system_prompt = self.get_system_prompt()
             response = await self.bedrock_service.generate_response(
                 messages=messages,
-                system_prompt=system_prompt,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system_prompt_blocks=system_prompt_blocks or self.get_system_prompt_blocks()
             )
             return response
         except Exception as e:
             self.logger.error(f"Error generating response: {str(e)}")
             raise
     
+    async def stream_response(self, messages: List[Dict[str, str]], max_tokens: int = 1000) -> AsyncIterator[str]:
+        """Stream a response from the bedrock service as text chunks"""
+        try:
+            async for chunk in self.bedrock_service.stream_response(
+                messages=messages,
+                max_tokens=max_tokens,
+                system_prompt_blocks=self.get_system_prompt_blocks()
+            ):
+                yield chunk
+        except Exception as e:
+            self.logger.error(f"Error streaming response: {str(e)}")
+            raise
+    
+    @staticmethod
+    async def collect(chunks: AsyncIterable[str]) -> str:
+        """Join a stream of text chunks into the full response"""
+        return "".join([chunk async for chunk in chunks])
+    
+    async def generate_structured_response(self, messages: List[Dict[str, str]], tool: Dict[str, Any], max_tokens: int = 300) -> Dict[str, Any]:
+        """Generate schema-validated structured output by forcing a call to `tool`"""
+        try:
+            return await self.bedrock_service.generate_structured_response(
+                messages=messages,
+                tool=tool,
+                max_tokens=max_tokens,
+                system_prompt_blocks=self.get_system_prompt_blocks()
+            )
+        except Exception as e:
+            self.logger.error(f"Error generating structured response: {str(e)}")
+            raise
+    
     def log_interaction(self, task: str, response: Dict[str, Any]):
         """Log the interaction for debugging purposes"""
-        self.logger.info(f"Task: {task[:100]}...")
-        self.logger.info(f"Response: {response.get('content', '')[:100]}...")
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        # %-style arguments let the logging module do the truncation lazily
+        self.logger.info("Task: %.100s...", task)
+        self.logger.info("Response: %.100s...", response.get('content', ''))
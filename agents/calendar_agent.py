@@ -1,17 +1,131 @@
-import json
+import asyncio
 import logging
+import re
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
-from sqlalchemy import and_, or_
-from .base_agent import BaseAgent
+from typing import Dict, Any, List, Tuple
+from sqlalchemy import and_, or_, text
+from .base_agent import BaseAgent, ResponseCache, normalize_task
+from .nl_datetime import parse_calendar_task
 from models import CalendarEvent
 from app import db
+import config
+
+# Page size bounds for _list_events
+_LIST_EVENTS_DEFAULT_LIMIT = 50
+_LIST_EVENTS_MAX_LIMIT = 200
+
+# Conflict check + insert is a critical section. Row locks cannot protect it:
+# when nothing overlaps there is no row to lock, so two creates would both
+# pass. Threads of this process serialize on the lock below, and on
+# PostgreSQL every process also takes a transaction-level advisory lock.
+_INSERT_LOCK = threading.Lock()
+_INSERT_ADVISORY_LOCK_KEY = 0x63616C656E646172  # "calendar"
+
+# Analyses are cached per day, so only those that resolve the same way all
+# day may be reused. Writes carry absolute times taken from the request, and
+# these phrasings are resolved against the current time of day.
+_UNCACHED_ACTIONS = frozenset(('create_event', 'update_event', 'delete_event'))
+_NOW_RELATIVE_RE = re.compile(
+    r"\b(?:in (?:\d+|an?|a few|half an) (?:minutes?|mins?|hours?|hrs?)|now|later|soon|"
+    r"this (?:morning|afternoon|evening)|tonight|next hour)\b",
+    re.IGNORECASE
+)
+
+_EVENT_PROPERTIES = {
+    "title": {"type": "string", "description": "Event title if creating/updating"},
+    "start_time": {"type": "string", "description": "Start datetime in ISO format if specified"},
+    "end_time": {"type": "string", "description": "End datetime in ISO format if specified"},
+    "description": {"type": "string"},
+    "location": {"type": "string"},
+    "all_day": {"type": "boolean"}
+}
+
+# Tool definition used to get the calendar intent back as schema-validated
+# structured output instead of free-form JSON text
+_CALENDAR_INTENT_TOOL = {
+    "name": "classify_calendar_intent",
+    "description": "Record the calendar action requested by the user and the details extracted from it.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "action_type": {
+                "type": "string",
+                "enum": ["create_event", "list_events", "update_event", "delete_event", "find_free_time", "general_query"]
+            },
+            "event_details": {
+                "type": "object",
+                "properties": _EVENT_PROPERTIES
+            },
+            "events": {
+                "type": "array",
+                "description": "Every event to create when the request asks for more than one",
+                "items": {"type": "object", "properties": _EVENT_PROPERTIES}
+            },
+            "query_parameters": {
+                "type": "object",
+                "properties": {
+                    "date_range_start": {"type": "string", "description": "Start date for queries in ISO format"},
+                    "date_range_end": {"type": "string", "description": "End date for queries in ISO format"},
+                    "search_term": {"type": "string", "description": "Search term for finding events"},
+                    "limit": {"type": "integer", "description": "Maximum number of events to list"},
+                    "after_id": {"type": "integer", "description": "Continue listing after the event with this id"}
+                }
+            },
+            "reasoning": {"type": "string", "description": "Short explanation of the analysis"}
+        },
+        "required": ["action_type"]
+    }
+}
+
+_ANALYSIS_INSTRUCTIONS = """Classify the calendar request below and extract its details with the classify_calendar_intent tool.
+
+For date/time parsing:
+- "tomorrow" = next day
+- "next week" = following week
+- Handle various natural language time expressions
+- Default to 1-hour duration if end time not specified
+- Use the current date/time given with the request as reference
+
+Action type guidelines:
+- create_event: "schedule", "book", "add event", "create meeting"; put each event in "events" when several are requested
+- list_events: "what's on", "my schedule", "show events", "what do I have"
+- update_event: "change", "modify", "reschedule", "update"
+- delete_event: "cancel", "remove", "delete"
+- find_free_time: "when am I free", "available times", "find time"
+- general_query: other calendar-related questions"""
+
+_ANALYSIS_REQUEST_TEMPLATE = """Current date/time: %s
+
+User Request: "%s"
+"""
 
 class CalendarAgent(BaseAgent):
     """Specialized agent for calendar and scheduling operations"""
     
+    KEYWORDS = (
+        'schedule', 'calendar', 'meeting', 'appointment', 'event',
+        'book', 'reserve', 'plan', 'date', 'time', 'when',
+        'available', 'busy', 'free', 'tomorrow', 'today',
+        'next week', 'monday', 'tuesday', 'wednesday', 'thursday',
+        'friday', 'saturday', 'sunday', 'cancel', 'reschedule'
+    )
+    _KEYWORD_PATTERN = BaseAgent.compile_keywords(KEYWORDS)
+    
+    CAPABILITIES = (
+        "Create and manage calendar events",
+        "Schedule meetings and appointments",
+        "Check availability and find free time slots",
+        "Handle date/time parsing in natural language",
+        "Detect and resolve scheduling conflicts",
+        "Provide schedule summaries and reminders"
+    )
+    
     def __init__(self, bedrock_service, tools_service=None):
         super().__init__("calendar_agent", bedrock_service, tools_service)
+        self._analysis_cache = ResponseCache()
+        list_ttl = config.CONFIG.LIST_EVENTS_CACHE_TTL
+        self._list_cache = ResponseCache(max_entries=64, ttl=timedelta(seconds=list_ttl)) if list_ttl > 0 else None
         
     def get_system_prompt(self) -> str:
         return """You are a Calendar Assistant AI specialized in scheduling and event management.
@@ -39,16 +153,7 @@ Use appropriate date parsing for natural language like "tomorrow at 2 PM" or "ne
 
     def can_handle(self, task: str, context: Dict[str, Any]) -> bool:
         """Determine if this is a calendar-related task"""
-        calendar_keywords = [
-            'schedule', 'calendar', 'meeting', 'appointment', 'event',
-            'book', 'reserve', 'plan', 'date', 'time', 'when',
-            'available', 'busy', 'free', 'tomorrow', 'today',
-            'next week', 'monday', 'tuesday', 'wednesday', 'thursday',
-            'friday', 'saturday', 'sunday', 'cancel', 'reschedule'
-        ]
-        
-        task_lower = task.lower()
-        return any(keyword in task_lower for keyword in calendar_keywords)
+        return self._KEYWORD_PATTERN.search(task) is not None
     
     async def process_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Process calendar-related tasks"""
@@ -59,6 +164,8 @@ Use appropriate date parsing for natural language like "tomorrow at 2 PM" or "ne
             action_type = action_analysis.get('action_type')
             
             if action_type == 'create_event':
+                if len(action_analysis.get('events') or ()) > 1:
+                    return await self._create_events_bulk(action_analysis, context)
                 return await self._create_event(action_analysis, context)
             elif action_type == 'list_events':
                 return await self._list_events(action_analysis, context)
@@ -79,52 +186,36 @@ Use appropriate date parsing for natural language like "tomorrow at 2 PM" or "ne
     async def _analyze_calendar_action(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze the calendar task to determine specific action needed"""
         
-        analysis_prompt = f"""Analyze this calendar request and extract structured information:
-
-User Request: "{task}"
-
-Determine the action type and extract relevant details. Respond with JSON in this format:
-{{
-    "action_type": "create_event|list_events|update_event|delete_event|find_free_time|general_query",
-    "event_details": {{
-        "title": "event title if creating/updating",
-        "start_time": "parsed datetime in ISO format if specified",
-        "end_time": "parsed datetime in ISO format if specified", 
-        "description": "description if provided",
-        "location": "location if provided",
-        "all_day": true/false
-    }},
-    "query_parameters": {{
-        "date_range_start": "start date for queries in ISO format",
-        "date_range_end": "end date for queries in ISO format",
-        "search_term": "search term for finding events"
-    }},
-    "reasoning": "explanation of the analysis"
-}}
-
-For date/time parsing:
-- "tomorrow" = next day
-- "next week" = following week
-- Handle various natural language time expressions
-- Default to 1-hour duration if end time not specified
-- Use current date/time as reference: {datetime.now().isoformat()}
-
-Action type guidelines:
-- create_event: "schedule", "book", "add event", "create meeting"
-- list_events: "what's on", "my schedule", "show events", "what do I have"
-- update_event: "change", "modify", "reschedule", "update"
-- delete_event: "cancel", "remove", "delete"
-- find_free_time: "when am I free", "available times", "find time"
-- general_query: other calendar-related questions"""
-
+        # Common unambiguous phrasings are parsed locally without an LLM call
+        local_analysis = parse_calendar_task(task, datetime.now())
+        if local_analysis is not None:
+            self.logger.debug("Calendar task parsed locally")
+            return local_analysis
+        
+        # Relative dates ("tomorrow") resolve differently each day, so the
+        # current date is part of the cache key
+        cache_key = (datetime.now().date().isoformat(), normalize_task(task))
+        cached = self._analysis_cache.get(cache_key)
+        if cached is not None:
+            self.logger.debug("Calendar analysis cache hit")
+            return cached
+        
         try:
-            messages = [{"role": "user", "content": analysis_prompt}]
-            response = await self.generate_response(messages, max_tokens=500)
+            # Static instructions come first as a prompt-cache checkpoint; only
+            # the short request block changes between calls
+            messages = [{"role": "user", "content": [
+                {"type": "text", "text": _ANALYSIS_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": _ANALYSIS_REQUEST_TEMPLATE % (datetime.now().isoformat(), task)}
+            ]}]
+            analysis = await self.generate_structured_response(messages, _CALENDAR_INTENT_TOOL, max_tokens=300)
+            analysis.setdefault('event_details', {})
+            analysis.setdefault('query_parameters', {})
             
-            analysis = json.loads(response.strip())
+            if analysis.get('action_type') not in _UNCACHED_ACTIONS and not _NOW_RELATIVE_RE.search(task):
+                self._analysis_cache.add(cache_key, analysis)
             return analysis
             
-        except (json.JSONDecodeError, Exception) as e:
+        except Exception as e:
             self.logger.warning(f"Error analyzing calendar action: {str(e)}")
             return {
                 "action_type": "general_query",
@@ -146,20 +237,14 @@ Action type guidelines:
                 return self.format_error("I need a start time for the event. Please specify when you'd like to schedule it.")
             
             # Parse datetime strings
-            start_time = datetime.fromisoformat(event_details['start_time'].replace('Z', '+00:00'))
+            start_time = datetime.fromisoformat(event_details['start_time'])
             
             # Set end time (default to 1 hour later if not specified)
             if event_details.get('end_time'):
-                end_time = datetime.fromisoformat(event_details['end_time'].replace('Z', '+00:00'))
+                end_time = datetime.fromisoformat(event_details['end_time'])
             else:
                 end_time = start_time + timedelta(hours=1)
             
-            # Check for conflicts
-            conflicts = self._check_conflicts(start_time, end_time)
-            if conflicts:
-                conflict_info = ", ".join([f"{event.title} ({event.start_time.strftime('%H:%M')}-{event.end_time.strftime('%H:%M')})" for event in conflicts])
-                return self.format_error(f"Time conflict detected with: {conflict_info}. Please choose a different time.")
-            
             # Create the event
             event = CalendarEvent(
                 title=event_details['title'],
@@ -170,8 +255,12 @@ Action type guidelines:
                 all_day=event_details.get('all_day', False)
             )
             
-            db.session.add(event)
-            db.session.commit()
+            # Check for conflicts and insert in the same transaction, off the event loop
+            conflicts = await asyncio.to_thread(self._insert_events, [event])
+            if conflicts:
+                conflict_info = ", ".join([f"{title} ({start.strftime('%H:%M')}-{end.strftime('%H:%M')})" for _, title, start, end in conflicts])
+                return self.format_error(f"Time conflict detected with: {conflict_info}. Please choose a different time.")
+            self._invalidate_listings()
             
             return self.format_response(
                 f"✅ Event created successfully!\n\n"
@@ -191,6 +280,55 @@ Action type guidelines:
             self.logger.error(f"Error creating event: {str(e)}")
             return self.format_error(f"Failed to create event: {str(e)}")
     
+    async def _create_events_bulk(self, analysis: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+        """Create several calendar events with one conflict query and one commit"""
+        try:
+            new_events = []
+            for details in analysis['events']:
+                if not details.get('title') or not details.get('start_time'):
+                    return self.format_error("Each event needs a title and a start time. Please check the events you'd like to schedule.")
+                
+                start_time = datetime.fromisoformat(details['start_time'])
+                if details.get('end_time'):
+                    end_time = datetime.fromisoformat(details['end_time'])
+                else:
+                    end_time = start_time + timedelta(hours=1)
+                
+                new_events.append(CalendarEvent(
+                    title=details['title'],
+                    description=details.get('description', ''),
+                    start_time=start_time,
+                    end_time=end_time,
+                    location=details.get('location', ''),
+                    all_day=details.get('all_day', False)
+                ))
+            
+            conflicts = await asyncio.to_thread(self._insert_events, new_events)
+            if conflicts:
+                conflict_info = "; ".join(
+                    f"{new_title} overlaps {title} ({start.strftime('%H:%M')}-{end.strftime('%H:%M')})"
+                    for new_title, title, start, end in conflicts
+                )
+                return self.format_error(f"Time conflicts detected: {conflict_info}. Please choose different times.")
+            self._invalidate_listings()
+            
+            lines = [f"✅ Created {len(new_events)} events:\n"]
+            for event in sorted(new_events, key=lambda e: e.start_time):
+                lines.append(
+                    f"**{event.title}** — {event.start_time.strftime('%A, %B %d, %Y')} "
+                    f"{event.start_time.strftime('%I:%M %p')} - {event.end_time.strftime('%I:%M %p')}"
+                )
+            
+            return self.format_response("\n".join(lines), {
+                'event_ids': [event.id for event in new_events],
+                'events_data': CalendarEvent.bulk_to_dict(new_events),
+                'action_performed': 'create_event'
+            })
+            
+        except Exception as e:
+            self.logger.error(f"Error creating events: {str(e)}")
+            return self.format_error(f"Failed to create events: {str(e)}")
+    
     async def _list_events(self, analysis: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """List calendar events based on query parameters"""
         try:
@@ -200,70 +338,159 @@ Action type guidelines:
             if not query_params.get('date_range_start'):
                 start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
             else:
-                start_date = datetime.fromisoformat(query_params['date_range_start'].replace('Z', '+00:00'))
+                start_date = datetime.fromisoformat(query_params['date_range_start'])
             
             if not query_params.get('date_range_end'):
                 end_date = start_date + timedelta(days=1)
             else:
-                end_date = datetime.fromisoformat(query_params['date_range_end'].replace('Z', '+00:00'))
+                end_date = datetime.fromisoformat(query_params['date_range_end'])
             
-            # Query events
-            events_query = CalendarEvent.query.filter(
-                and_(
-                    CalendarEvent.start_time >= start_date,
-                    CalendarEvent.start_time < end_date
-                )
-            ).order_by(CalendarEvent.start_time)
+            limit = min(int(query_params.get('limit') or _LIST_EVENTS_DEFAULT_LIMIT), _LIST_EVENTS_MAX_LIMIT)
+            after_id = query_params.get('after_id')
             
-            events = events_query.all()
+            # Back-to-back identical listings are served from memory; writes clear the cache
+            cache_key = (start_date.isoformat(), end_date.isoformat(), limit, after_id)
+            if self._list_cache is not None:
+                cached = self._list_cache.get(cache_key)
+                if cached is not None:
+                    return self.format_response(*cached)
+            
+            # Fetch one extra row to learn whether another page exists
+            events = await asyncio.to_thread(self._query_events, start_date, end_date, limit + 1, after_id)
+            has_more = len(events) > limit
+            events = events[:limit]
+            next_cursor = events[-1].id if has_more else None
             
             if not events:
                 date_str = start_date.strftime('%A, %B %d, %Y')
-                return self.format_response(
+                result = (
                     f"📅 No events scheduled for {date_str}",
                     {'events': [], 'date_range': {'start': start_date.isoformat(), 'end': end_date.isoformat()}}
                 )
+                self._cache_listing(cache_key, result)
+                return self.format_response(*result)
             
-            # Format events list
-            events_text = f"📅 **Your Schedule for {start_date.strftime('%A, %B %d, %Y')}**\n\n"
+            # Format events list; parts are joined once to avoid quadratic string building
+            parts = [f"📅 **Your Schedule for {start_date.strftime('%A, %B %d, %Y')}**\n\n"]
             
             for event in events:
                 time_str = event.start_time.strftime('%I:%M %p')
                 if not event.all_day:
                     time_str += f" - {event.end_time.strftime('%I:%M %p')}"
                 
-                events_text += f"• **{event.title}**\n"
-                events_text += f"  🕐 {time_str}\n"
+                parts.append(f"• **{event.title}**\n  🕐 {time_str}\n")
                 if event.location:
-                    events_text += f"  📍 {event.location}\n"
+                    parts.append(f"  📍 {event.location}\n")
                 if event.description:
-                    events_text += f"  📝 {event.description}\n"
-                events_text += "\n"
+                    parts.append(f"  📝 {event.description}\n")
+                parts.append("\n")
             
-            return self.format_response(
-                events_text.strip(),
+            if has_more:
+                parts.append(f"Showing the first {limit} events. Ask for more to see the rest.\n")
+            
+            events_text = "".join(parts).strip()
+            
+            result = (
+                events_text,
                 {
-                    'events': [event.to_dict() for event in events],
+                    'events': CalendarEvent.bulk_to_dict(events),
                     'date_range': {'start': start_date.isoformat(), 'end': end_date.isoformat()},
+                    'next_cursor': next_cursor,
                     'action_performed': 'list_events'
                 }
             )
+            self._cache_listing(cache_key, result)
+            return self.format_response(*result)
             
         except Exception as e:
             self.logger.error(f"Error listing events: {str(e)}")
             return self.format_error(f"Failed to retrieve events: {str(e)}")
     
+    def _query_events(self, start_date: datetime, end_date: datetime, limit: int, after_id) -> List[CalendarEvent]:
+        """Events starting in [start_date, end_date) after the cursor event, in order (blocking)"""
+        events_query = CalendarEvent.query.filter(
+            and_(
+                CalendarEvent.start_time >= start_date,
+                CalendarEvent.start_time < end_date
+            )
+        )
+        
+        # Keyset pagination on (start_time, id) continuing after the cursor event
+        if after_id:
+            cursor_event = db.session.get(CalendarEvent, int(after_id))
+            if cursor_event:
+                events_query = events_query.filter(
+                    or_(
+                        CalendarEvent.start_time > cursor_event.start_time,
+                        and_(CalendarEvent.start_time == cursor_event.start_time, CalendarEvent.id > cursor_event.id)
+                    )
+                )
+        
+        return events_query.order_by(CalendarEvent.start_time, CalendarEvent.id).limit(limit).all()
+    
+    def _insert_events(self, new_events: List[CalendarEvent]) -> List[Tuple[str, str, datetime, datetime]]:
+        """Insert events unless they overlap each other or stored events (blocking)
+        
+        Returns (new title, conflicting title, its start, its end) for every
+        overlap and writes nothing if there are any. Inserted events are
+        reloaded before returning, so they can be serialized without further
+        queries.
+        
+        The check and the insert are serialized against other inserts: always
+        within this process, and across processes on PostgreSQL. Several
+        processes sharing one SQLite file are not covered.
+        """
+        with _INSERT_LOCK:
+            try:
+                if db.session.get_bind().dialect.name == 'postgresql':
+                    # Released by the commit or rollback below
+                    db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _INSERT_ADVISORY_LOCK_KEY})
+                
+                # One query over the whole span, then exact overlap checks in memory
+                existing = self._check_conflicts(
+                    min(event.start_time for event in new_events),
+                    max(event.end_time for event in new_events)
+                )
+                
+                conflicts = []
+                for index, event in enumerate(new_events):
+                    others = existing + new_events[index + 1:]
+                    for other in others:
+                        if other.start_time < event.end_time and other.end_time > event.start_time:
+                            conflicts.append((event.title, other.title, other.start_time, other.end_time))
+                
+                if conflicts:
+                    db.session.rollback()
+                    return conflicts
+                
+                db.session.add_all(new_events)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        
+        # The commit expired them; load ids and database-set columns here
+        for event in new_events:
+            db.session.refresh(event)
+        return []
+    
+    def _cache_listing(self, key: tuple, result: tuple):
+        """Remember a (content, additional_data) listing result if caching is enabled"""
+        if self._list_cache is not None:
+            self._list_cache.add(key, result)
+    
+    def _invalidate_listings(self):
+        """Drop cached listings after the calendar changes"""
+        if self._list_cache is not None:
+            self._list_cache.clear()
+    
     def _check_conflicts(self, start_time: datetime, end_time: datetime) -> List[CalendarEvent]:
         """Check for scheduling conflicts"""
-        conflicts = CalendarEvent.query.filter(
-            or_(
-                and_(CalendarEvent.start_time <= start_time, CalendarEvent.end_time > start_time),
-                and_(CalendarEvent.start_time < end_time, CalendarEvent.end_time >= end_time),
-                and_(CalendarEvent.start_time >= start_time, CalendarEvent.end_time <= end_time)
-            )
+        # Two intervals overlap iff each one starts before the other ends
+        return CalendarEvent.query.filter(
+            CalendarEvent.start_time < end_time,
+            CalendarEvent.end_time > start_time
         ).all()
-        
-        return conflicts
     
     async def _update_event(self, analysis: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """Update an existing event"""
@@ -283,8 +510,7 @@ Action type guidelines:
     async def _handle_general_query(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Handle general calendar queries"""
         try:
-            messages = context.get('messages', [])
-            messages.append({"role": "user", "content": task})
+            messages = self.build_messages(context, task)
             
             response = await self.generate_response(messages)
             
@@ -295,14 +521,3 @@ Action type guidelines:
         except Exception as e:
             self.logger.error(f"Error handling general query: {str(e)}")
             return self.format_error(f"Failed to process query: {str(e)}")
-    
-    def get_capabilities(self) -> List[str]:
-        """Return calendar agent capabilities"""
-        return [
-            "Create and manage calendar events",
-            "Schedule meetings and appointments", 
-            "Check availability and find free time slots",
-            "Handle date/time parsing in natural language",
-            "Detect and resolve scheduling conflicts",
-            "Provide schedule summaries and reminders"
-        ]
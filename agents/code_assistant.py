@@ -1,12 +1,123 @@
+import ast
+import functools
 import logging
+import re
 from typing import Dict, Any, List, Optional
-from .base_agent import BaseAgent
+from .base_agent import BaseAgent, ResponseCache, routing_key
+
+# Task type cues from the analysis guidelines, one named group per type
+_TASK_TYPE_KEYWORDS = {
+    'tool_usage': (r"python_repl", r"run python", r"execute python", r"editor", r"shell", r"terminal", r"journal"),
+    'debugging': (r"error", r"bug", r"fix", r"debug", r"not working", r"exception", r"traceback"),
+    'code_review': (r"review", r"optimi[sz]e", r"improve", r"best practices", r"refactor"),
+    'explanation': (r"explain", r"how does", r"what is", r"understand", r"concept"),
+    'code_generation': (r"write", r"create", r"generate", r"build", r"implement"),
+}
+
+_TASK_TYPE_RE = re.compile(
+    "|".join(
+        rf"(?P<{task_type}>\b(?:{'|'.join(patterns)})\w*)"
+        for task_type, patterns in _TASK_TYPE_KEYWORDS.items()
+    ),
+    re.IGNORECASE
+)
+
+_LANGUAGE_RE = re.compile(
+    r"\b(python|javascript|typescript|java|c\+\+|c#|golang|rust|ruby|php|sql|html|css|bash)(?![\w+#])",
+    re.IGNORECASE
+)
+
+
+def _guarded(log_message: str, error_message: str):
+    """Turn exceptions from an async handler into a logged, formatted error response"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, *args, **kwargs):
+            try:
+                return await handler(self, *args, **kwargs)
+            except Exception as e:
+                self.logger.error(f"{log_message}: {str(e)}")
+                return self.format_error(f"{error_message}: {str(e)}")
+        return wrapper
+    return decorator
+
+
+# Every fenced block with its language tag. Matching all blocks, not just
+# Python ones, consumes each closing fence, so it can't be mistaken for the
+# opening of a block; closing fences must start a line. Opening fences may
+# follow text on the same line, as they often do in chat messages.
+_CODE_FENCE_RE = re.compile(r"```(\w*)[ \t]*\n(.*?)^```", re.DOTALL | re.MULTILINE)
+_PYTHON_FENCE_TAGS = frozenset(('python', 'py'))
+_BARE_CODE_LINE_RE = re.compile(r"^.*(?:print\(|def |import |from |=).*$", re.MULTILINE)
+
+# Tool definition used to get the coding analysis back as schema-validated
+# structured output instead of free-form JSON text
+_CODING_TASK_TOOL = {
+    "name": "classify_coding_task",
+    "description": "Record the type of programming assistance the user needs and the details extracted from the request.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "task_type": {
+                "type": "string",
+                "enum": ["code_generation", "debugging", "code_review", "explanation", "tool_usage", "general"]
+            },
+            "programming_language": {"type": "string", "description": "Detected programming language, if any"},
+            "complexity": {"type": "string", "enum": ["simple", "medium", "complex"]},
+            "specific_help": {"type": "string", "description": "Specific area of help needed"},
+            "reasoning": {"type": "string", "description": "Short explanation of the analysis"}
+        },
+        "required": ["task_type"]
+    }
+}
+
+_CODING_ANALYSIS_INSTRUCTIONS = """Analyze the programming request that follows, determine the type of assistance needed and record it with the classify_coding_task tool.
+
+Task type guidelines:
+- code_generation: "write", "create", "generate", "build", "implement"
+- debugging: "error", "bug", "fix", "debug", "not working", "exception"
+- code_review: "review", "optimize", "improve", "best practices", "refactor"
+- explanation: "explain", "how does", "what is", "understand", "concept"
+- tool_usage: mentions of "python_repl", "editor", "shell", "journal" or wanting to run/execute code
+- general: other programming questions or guidance"""
+
 
 class CodeAssistantAgent(BaseAgent):
     """Specialized agent for programming help and code generation"""
     
+    KEYWORDS = (
+        'code', 'program', 'script', 'function', 'debug', 'error',
+        'python', 'javascript', 'java', 'cpp', 'html', 'css',
+        'react', 'vue', 'angular', 'node', 'flask', 'django',
+        'sql', 'database', 'api', 'algorithm', 'class', 'method',
+        'variable', 'loop', 'condition', 'syntax', 'compile',
+        'runtime', 'exception', 'library', 'framework', 'git',
+        'deploy', 'test', 'unit test', 'refactor', 'optimize'
+    )
+    _KEYWORD_PATTERN = BaseAgent.compile_keywords(KEYWORDS)
+    
+    CAPABILITIES = (
+        "Code generation in multiple languages",
+        "Debugging and error resolution",
+        "Code review and optimization",
+        "Programming concept explanations",
+        "Algorithm and data structure help",
+        "API integration assistance",
+        "Testing and documentation guidance",
+        "Built-in tool integration (python_repl, editor, shell, journal)"
+    )
+    
+    # (keyword pattern, handler method name) pairs checked in order
+    _TOOL_DISPATCH = (
+        (BaseAgent.compile_keywords(('python_repl', 'run python', 'execute python')), '_use_python_repl'),
+        (BaseAgent.compile_keywords(('editor', 'edit file', 'create file')), '_use_editor'),
+        (BaseAgent.compile_keywords(('shell', 'command', 'terminal')), '_use_shell'),
+        (BaseAgent.compile_keywords(('journal', 'note')), '_use_journal'),
+    )
+    
     def __init__(self, bedrock_service, tools_service=None):
         super().__init__("code_assistant", bedrock_service, tools_service)
+        self._analysis_cache = ResponseCache()
         
     def get_system_prompt(self) -> str:
         return """You are a Code Assistant AI specialized in programming help and software development.
@@ -39,18 +150,7 @@ Always write production-ready code with proper error handling, documentation, an
 
     def can_handle(self, task: str, context: Dict[str, Any]) -> bool:
         """Determine if this is a code/programming-related task"""
-        code_keywords = [
-            'code', 'program', 'script', 'function', 'debug', 'error',
-            'python', 'javascript', 'java', 'cpp', 'html', 'css',
-            'react', 'vue', 'angular', 'node', 'flask', 'django',
-            'sql', 'database', 'api', 'algorithm', 'class', 'method',
-            'variable', 'loop', 'condition', 'syntax', 'compile',
-            'runtime', 'exception', 'library', 'framework', 'git',
-            'deploy', 'test', 'unit test', 'refactor', 'optimize'
-        ]
-        
-        task_lower = task.lower()
-        return any(keyword in task_lower for keyword in code_keywords)
+        return self._KEYWORD_PATTERN.search(task) is not None
     
     async def process_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Process programming-related tasks"""
@@ -80,33 +180,35 @@ Always write production-ready code with proper error handling, documentation, an
     async def _analyze_coding_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze the coding task to determine the type of assistance needed"""
         
-        analysis_prompt = f"""Analyze this programming request and determine the type of assistance needed:
-
-User Request: "{task}"
-
-Determine the task type and extract relevant details. Respond with JSON in this format:
-{{
-    "task_type": "code_generation|debugging|code_review|explanation|tool_usage|general",
-    "programming_language": "detected language or null",
-    "complexity": "simple|medium|complex",
-    "specific_help": "specific area of help needed",
-    "reasoning": "explanation of the analysis"
-}}
-
-Task type guidelines:
-- code_generation: "write", "create", "generate", "build", "implement"
-- debugging: "error", "bug", "fix", "debug", "not working", "exception"
-- code_review: "review", "optimize", "improve", "best practices", "refactor"
-- explanation: "explain", "how does", "what is", "understand", "concept"
-- tool_usage: mentions of "python_repl", "editor", "shell", "journal" or wanting to run/execute code
-- general: other programming questions or guidance"""
-
+        # A single unambiguous task-type cue is enough to skip the LLM analysis
+        task_types = {match.lastgroup for match in _TASK_TYPE_RE.finditer(task)}
+        if len(task_types) == 1:
+            task_type = task_types.pop()
+            analysis = {
+                "task_type": task_type,
+                "complexity": "medium",
+                "specific_help": task_type.replace('_', ' '),
+                "reasoning": f"Request matches {task_type} keywords"
+            }
+            language = _LANGUAGE_RE.search(task)
+            if language:
+                analysis["programming_language"] = language.group(1)
+            return analysis
+        
+        cache_key = routing_key(task)
+        cached = self._analysis_cache.get(cache_key)
+        if cached is not None:
+            self.logger.debug("Coding analysis cache hit")
+            return cached
+        
         try:
-            messages = [{"role": "user", "content": analysis_prompt}]
-            response = await self.generate_response(messages, max_tokens=300)
-            
-            import json
-            analysis = json.loads(response.strip())
+            # Static instructions first so they form a stable cacheable prefix
+            messages = [{"role": "user", "content": [
+                {"type": "text", "text": _CODING_ANALYSIS_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": f'User Request: "{task}"'}
+            ]}]
+            analysis = await self.generate_structured_response(messages, _CODING_TASK_TOOL, max_tokens=300)
+            self._analysis_cache.add(cache_key, analysis)
             return analysis
             
         except Exception as e:
@@ -119,12 +221,12 @@ Task type guidelines:
                 "reasoning": "Unable to analyze, treating as general help"
             }
     
+    @_guarded("Error generating code", "Failed to generate code")
     async def _generate_code(self, task: str, context: Dict[str, Any], analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Generate code based on the user's request"""
-        try:
-            language = analysis.get('programming_language', 'Python')
-            
-            enhanced_prompt = f"""Generate code for this request: {task}
+        language = analysis.get('programming_language', 'Python')
+        
+        enhanced_prompt = f"""Generate code for this request: {task}
 
 Requirements:
 - Use {language} if specified, otherwise choose the most appropriate language
@@ -135,28 +237,23 @@ Requirements:
 
 Provide the code with explanations."""
 
-            messages = context.get('messages', [])
-            messages.append({"role": "user", "content": enhanced_prompt})
-            
-            response = await self.generate_response(messages, max_tokens=1500)
-            
-            return self.format_response(
-                response,
-                {
-                    'code_generated': True,
-                    'programming_language': language,
-                    'action_performed': 'code_generation'
-                }
-            )
-            
-        except Exception as e:
-            self.logger.error(f"Error generating code: {str(e)}")
-            return self.format_error(f"Failed to generate code: {str(e)}")
+        messages = self.build_messages(context, enhanced_prompt)
+        
+        response = await self.generate_response(messages, max_tokens=1500)
+        
+        return self.format_response(
+            response,
+            {
+                'code_generated': True,
+                'programming_language': language,
+                'action_performed': 'code_generation'
+            }
+        )
     
+    @_guarded("Error helping with debugging", "Failed to provide debugging help")
     async def _help_debug(self, task: str, context: Dict[str, Any], analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Help debug code issues"""
-        try:
-            debug_prompt = f"""Help debug this issue: {task}
+        debug_prompt = f"""Help debug this issue: {task}
 
 Please provide:
 1. Analysis of the problem
@@ -167,22 +264,17 @@ Please provide:
 
 Be thorough and educational in your debugging assistance."""
 
-            messages = context.get('messages', [])
-            messages.append({"role": "user", "content": debug_prompt})
-            
-            response = await self.generate_response(messages, max_tokens=1200)
-            
-            return self.format_response(
-                response,
-                {
-                    'debugging_help': True,
-                    'action_performed': 'debugging'
-                }
-            )
-            
-        except Exception as e:
-            self.logger.error(f"Error helping with debugging: {str(e)}")
-            return self.format_error(f"Failed to provide debugging help: {str(e)}")
+        messages = self.build_messages(context, debug_prompt)
+        
+        response = await self.generate_response(messages, max_tokens=1200)
+        
+        return self.format_response(
+            response,
+            {
+                'debugging_help': True,
+                'action_performed': 'debugging'
+            }
+        )
     
     async def _review_code(self, task: str, context: Dict[str, Any], analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Review and provide feedback on code"""
@@ -198,19 +290,12 @@ Be thorough and educational in your debugging assistance."""
             if not self.tools_service:
                 return self.format_error("Built-in tools are not available in this session.")
             
-            # Determine which tool to use
-            task_lower = task.lower()
+            # Determine which tool to use; the first matching entry wins
+            for pattern, handler_name in self._TOOL_DISPATCH:
+                if pattern.search(task):
+                    return await getattr(self, handler_name)(task, context)
             
-            if 'python_repl' in task_lower or 'run python' in task_lower or 'execute python' in task_lower:
-                return await self._use_python_repl(task, context)
-            elif 'editor' in task_lower or 'edit file' in task_lower or 'create file' in task_lower:
-                return await self._use_editor(task, context)
-            elif 'shell' in task_lower or 'command' in task_lower or 'terminal' in task_lower:
-                return await self._use_shell(task, context)
-            elif 'journal' in task_lower or 'note' in task_lower:
-                return await self._use_journal(task, context)
-            else:
-                return await self._general_coding_help(task, context)
+            return await self._general_coding_help(task, context)
                 
         except Exception as e:
             self.logger.error(f"Error handling tool usage: {str(e)}")
@@ -252,24 +337,30 @@ Be thorough and educational in your debugging assistance."""
     
     async def _extract_python_code(self, task: str):
         """Extract Python code from user request"""
-        # Simple extraction - look for code blocks or python-like syntax
-        lines = task.split('\n')
-        code_lines = []
-        in_code_block = False
+        # Prefer fenced code blocks; otherwise take the lines that look like Python
+        fenced = _CODE_FENCE_RE.findall(task)
+        blocks = [code for tag, code in fenced if tag.lower() in _PYTHON_FENCE_TAGS]
+        # Untagged blocks are often shell commands or program output, so one
+        # is only taken as Python when it is the sole block and parses as such
+        if not blocks and len(fenced) == 1 and not fenced[0][0] and self._looks_like_python(fenced[0][1]):
+            blocks = [fenced[0][1]]
+        if blocks:
+            return '\n'.join(block.rstrip('\n') for block in blocks)
         
-        for line in lines:
-            if '```python' in line or '```py' in line:
-                in_code_block = True
-                continue
-            elif '```' in line and in_code_block:
-                in_code_block = False
-                continue
-            elif in_code_block:
-                code_lines.append(line)
-            elif any(keyword in line for keyword in ['print(', 'def ', 'import ', 'from ', '=']):
-                code_lines.append(line)
-        
-        return '\n'.join(code_lines) if code_lines else None
+        return '\n'.join(_BARE_CODE_LINE_RE.findall(task)) or None
+    
+    @staticmethod
+    def _looks_like_python(code: str) -> bool:
+        """True if code parses as Python and does more than evaluate bare names and operators"""
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            return False
+        # "ls -la /tmp" and "pwd" parse too, as expressions without calls
+        return any(
+            not isinstance(node, ast.Expr) or any(isinstance(child, ast.Call) for child in ast.walk(node))
+            for node in tree.body
+        )
     
     async def _use_editor(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Use editor tool"""
@@ -286,34 +377,16 @@ Be thorough and educational in your debugging assistance."""
         # Implementation for journal tool usage
         return self.format_response("Journal tool functionality is being implemented.")
     
+    @_guarded("Error providing general coding help", "Failed to provide coding assistance")
     async def _general_coding_help(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Provide general coding assistance"""
-        try:
-            messages = context.get('messages', [])
-            messages.append({"role": "user", "content": task})
-            
-            response = await self.generate_response(messages, max_tokens=1200)
-            
-            return self.format_response(
-                response,
-                {
-                    'action_performed': 'general_coding_help'
-                }
-            )
-            
-        except Exception as e:
-            self.logger.error(f"Error providing general coding help: {str(e)}")
-            return self.format_error(f"Failed to provide coding assistance: {str(e)}")
-    
-    def get_capabilities(self) -> List[str]:
-        """Return code assistant capabilities"""
-        return [
-            "Code generation in multiple languages",
-            "Debugging and error resolution",
-            "Code review and optimization",
-            "Programming concept explanations",
-            "Algorithm and data structure help",
-            "API integration assistance",
-            "Testing and documentation guidance",
-            "Built-in tool integration (python_repl, editor, shell, journal)"
-        ]
+        messages = self.build_messages(context, task)
+        
+        response = await self.generate_response(messages, max_tokens=1200)
+        
+        return self.format_response(
+            response,
+            {
+                'action_performed': 'general_coding_help'
+            }
+        )
@@ -0,0 +1,216 @@
+"""
+Local parser for common calendar requests.
+
+Handles the frequent, unambiguous phrasings ("what's on my calendar
+tomorrow?", "when am I free on Friday", "schedule team sync tomorrow at
+2pm for 30 minutes") with precompiled regular expressions so they never
+need an LLM round trip. Anything the grammar does not fully account for
+returns None and is left to the model.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+_DATE_RE = re.compile(
+    r"\b(?:"
+    r"(?P<day_after>(?:the\s+)?day\s+after\s+tomorrow)"
+    r"|(?P<today>today|tonight)"
+    r"|(?P<tomorrow>tomorrow)"
+    r"|(?P<week>this|next)\s+week"
+    r"|(?:(?P<weekday_prefix>on|this|next)\s+)?(?P<weekday>" + "|".join(_WEEKDAYS) + r")"
+    r")\b",
+    re.IGNORECASE
+)
+
+_TIME_RE = re.compile(
+    r"\b(?:at\s+)?(?:"
+    r"(?P<hour>\d{1,2})(?::(?P<minute>[0-5]\d))?\s*(?P<meridiem>[ap])\.?m\b\.?"
+    r"|(?P<hour24>[01]?\d|2[0-3]):(?P<minute24>[0-5]\d)"
+    r"|(?P<named>noon|midnight)"
+    r")",
+    re.IGNORECASE
+)
+
+_DURATION_RE = re.compile(
+    r"\bfor\s+(?P<amount>\d+|an?|half\s+an)\s+(?P<unit>hours?|hrs?|minutes?|mins?)\b",
+    re.IGNORECASE
+)
+
+_CREATE_RE = re.compile(r"^\s*(?:please\s+)?(?:schedule|book|add|create|set\s+up)\b", re.IGNORECASE)
+_FREE_RE = re.compile(r"\b(?:free|available|availability|open\s+slots?)\b", re.IGNORECASE)
+_LIST_RE = re.compile(
+    r"\b(?:what'?s\s+on|what\s+is\s+on|what\s+do\s+i\s+have|show|list|schedule|calendar|agenda|events?|meetings?|appointments?)\b",
+    re.IGNORECASE
+)
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Words that carry no information beyond the intent and date already parsed;
+# any other leftover word means the request says more than the grammar covers
+_FILLER_WORDS = frozenset((
+    'a', 'all', 'am', 'an', 'any', 'appointments', 'are', 'availability', 'available',
+    'calendar', 'can', 'could', 'do', 'event', 'events', 'find', 'for', 'free', 'have',
+    'i', 'is', 'list', 'me', 'meetings', 'my', 'on', 'open', 'please', 's', 'schedule',
+    'show', 'slot', 'slots', 'some', 'the', 'there', 'time', 'today', 'what', 'whats',
+    'when', 'you', 'agenda', 'going', 'happening', 'planned'
+))
+
+_TITLE_EDGE_RE = re.compile(r"^(?:an?|the|my)\s+|\s+(?:on|for|at)$", re.IGNORECASE)
+_TITLE_REJECT_RE = re.compile(r"\d|\b(?:at|in|from|to|until|every|each)\b", re.IGNORECASE)
+
+
+def parse_calendar_task(task: str, now: datetime) -> Optional[Dict[str, Any]]:
+    """
+    Return an analysis dict in the classify_calendar_intent shape, or None.
+
+    None means the request is ambiguous or outside the local grammar and
+    should be analyzed by the LLM instead.
+    """
+    date_matches = list(_DATE_RE.finditer(task))
+    if len(date_matches) > 1:
+        return None
+    date_match = date_matches[0] if date_matches else None
+
+    if _CREATE_RE.match(task):
+        return _parse_create(task, now, date_match)
+
+    if date_match is not None:
+        day_range = _resolve_date(date_match, now)
+        if day_range is None:
+            return None
+    else:
+        day_range = _day_bounds(now)
+
+    if _FREE_RE.search(task):
+        action_type = 'find_free_time'
+    elif _LIST_RE.search(task):
+        action_type = 'list_events'
+    else:
+        return None
+
+    residue = _DATE_RE.sub(" ", task).lower().replace("'", "")
+    if any(word not in _FILLER_WORDS for word in _WORD_RE.findall(residue)):
+        return None
+
+    start, end = day_range
+    return {
+        "action_type": action_type,
+        "event_details": {},
+        "query_parameters": {
+            "date_range_start": start.isoformat(),
+            "date_range_end": end.isoformat()
+        },
+        "reasoning": "Parsed locally"
+    }
+
+
+def _parse_create(task: str, now: datetime, date_match: Optional[re.Match]) -> Optional[Dict[str, Any]]:
+    """Parse '<verb> <title> <date> at <time> [for <duration>]' in any order"""
+    time_matches = list(_TIME_RE.finditer(task))
+    duration_matches = list(_DURATION_RE.finditer(task))
+    if date_match is None or len(time_matches) != 1 or len(duration_matches) > 1:
+        return None
+
+    day_range = _resolve_date(date_match, now)
+    clock = _resolve_time(time_matches[0])
+    if day_range is None or clock is None or date_match.group('week'):
+        return None
+
+    start_time = day_range[0].replace(hour=clock[0], minute=clock[1])
+    if start_time < now and date_match.group('weekday') and (date_match.group('weekday_prefix') or '').lower() != 'this':
+        start_time += timedelta(days=7)
+
+    duration = _resolve_duration(duration_matches[0]) if duration_matches else timedelta(hours=1)
+
+    # Whatever is left once the verb, date, time and duration are removed is the title
+    spans = sorted([date_match.span(), time_matches[0].span()] + [m.span() for m in duration_matches])
+    pieces = []
+    cursor = _CREATE_RE.match(task).end()
+    for begin, finish in spans:
+        pieces.append(task[cursor:begin])
+        cursor = finish
+    pieces.append(task[cursor:])
+    title = " ".join(" ".join(pieces).split()).strip(" ,.!?")
+    previous = None
+    while title != previous:
+        previous = title
+        title = _TITLE_EDGE_RE.sub("", title).strip()
+
+    if not title or len(title) > 80 or _TITLE_REJECT_RE.search(title):
+        return None
+
+    return {
+        "action_type": "create_event",
+        "event_details": {
+            "title": title[0].upper() + title[1:],
+            "start_time": start_time.isoformat(),
+            "end_time": (start_time + duration).isoformat()
+        },
+        "query_parameters": {},
+        "reasoning": "Parsed locally"
+    }
+
+
+def _day_bounds(day: datetime) -> Tuple[datetime, datetime]:
+    start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
+
+
+def _resolve_date(match: re.Match, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """Turn a date phrase into a [start, end) range"""
+    today_start = _day_bounds(now)[0]
+
+    if match.group('today'):
+        return _day_bounds(now)
+    if match.group('tomorrow'):
+        return _day_bounds(now + timedelta(days=1))
+    if match.group('day_after'):
+        return _day_bounds(now + timedelta(days=2))
+
+    if match.group('week'):
+        next_monday = today_start + timedelta(days=7 - now.weekday())
+        if match.group('week').lower() == 'this':
+            return today_start, next_monday
+        return next_monday, next_monday + timedelta(days=7)
+
+    # "next friday" means different things to different people
+    if (match.group('weekday_prefix') or '').lower() == 'next':
+        return None
+    target = _WEEKDAYS.index(match.group('weekday').lower())
+    return _day_bounds(now + timedelta(days=(target - now.weekday()) % 7))
+
+
+def _resolve_time(match: re.Match) -> Optional[Tuple[int, int]]:
+    """Return (hour, minute) for a time phrase"""
+    named = match.group('named')
+    if named:
+        return (12, 0) if named.lower() == 'noon' else (0, 0)
+
+    if match.group('hour24') is not None:
+        return int(match.group('hour24')), int(match.group('minute24'))
+
+    hour = int(match.group('hour'))
+    if not 1 <= hour <= 12:
+        return None
+    minute = int(match.group('minute') or 0)
+    if match.group('meridiem').lower() == 'p':
+        hour = hour % 12 + 12
+    else:
+        hour = hour % 12
+    return hour, minute
+
+
+def _resolve_duration(match: re.Match) -> timedelta:
+    amount_text = match.group('amount').lower()
+    if amount_text.startswith('half'):
+        amount = 0.5
+    elif amount_text in ('a', 'an'):
+        amount = 1
+    else:
+        amount = int(amount_text)
+
+    if match.group('unit').lower().startswith('h'):
+        return timedelta(hours=amount)
+    return timedelta(minutes=amount)
@@ -1,7 +1,96 @@
-import json
+import asyncio
+import bisect
 import logging
-from typing import Dict, Any, List
-from .base_agent import BaseAgent
+import math
+import re
+from collections import Counter
+from typing import Callable, Dict, Any, List, Optional, Type
+from .base_agent import BaseAgent, ResponseCache, routing_key
+import config
+import json_utils
+
+# Multi-word phrases that on their own clearly identify a specialist. Single
+# words such as "java", "compile" or "news" also turn up in travel requests,
+# so anything short of one of these phrases is left to the LLM analysis.
+_ROUTING_KEYWORDS = {
+    'calendar_agent': (
+        r"my (?:calendar|schedule)", r"(?:schedule|reschedule|cancel) (?:a|an|my|the) (?:meeting|appointment|call)",
+        r"am i (?:free|busy|available)"
+    ),
+    'search_agent': (
+        r"search (?:the web|online)", r"weather forecast", r"latest (?:news|headlines)",
+        r"news headlines", r"stock prices?"
+    ),
+    'code_assistant': (
+        r"(?:python|javascript|typescript|java|rust|sql) (?:code|script|function|error|query)",
+        r"stack ?trace", r"traceback \(most recent call last\)", r"syntax error", r"unit tests?",
+        r"python_repl"
+    ),
+}
+
+# One alternation with a named group per agent, scanned in a single pass
+_ROUTER_RE = re.compile(
+    "|".join(
+        rf"(?P<{agent_type}>\b(?:{'|'.join(patterns)})(?!\w))"
+        for agent_type, patterns in _ROUTING_KEYWORDS.items()
+    ),
+    re.IGNORECASE
+)
+
+_TERM_RE = re.compile(r"[a-z0-9+#]+")
+
+# Words too common to say anything about which agent a request is for
+_STOP_WORDS = frozenset((
+    'a', 'about', 'an', 'and', 'are', 'can', 'could', 'do', 'does', 'for', 'from', 'get',
+    'help', 'how', 'i', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'please', 's',
+    'some', 'tell', 'that', 'the', 'this', 'to', 'via', 'what', 'when', 'where', 'which',
+    'who', 'why', 'will', 'with', 'you', 'your'
+))
+
+# A similarity match only routes a task when it shares several terms with
+# one agent's capabilities, is strong enough and is clearly ahead of the
+# runner-up; anything closer goes to the LLM. A single shared word such as
+# "time" or "date" is as likely to be a travel question as a calendar one.
+_SIMILARITY_MIN_TERMS = 2
+_SIMILARITY_THRESHOLD = 0.25
+_SIMILARITY_MARGIN = 0.15
+
+
+def _term_vector(text: str) -> Dict[str, float]:
+    """Unit-length term-frequency vector of the informative words in text"""
+    counts = Counter(
+        term[:-1] if len(term) > 3 and term.endswith('s') else term
+        for term in _TERM_RE.findall(text.lower())
+        if term not in _STOP_WORDS
+    )
+    norm = math.sqrt(sum(count * count for count in counts.values()))
+    return {term: count / norm for term, count in counts.items()} if norm else {}
+
+_DELEGATION_INSTRUCTIONS = """Analyze the user request that follows and determine if it needs specialized agent assistance.
+
+Available Specialized Agents:
+- calendar_agent: Schedule management, event creation, meeting planning, date/time queries
+- search_agent: Web search, current information, research questions, factual queries
+- code_assistant: Programming help, code generation, debugging, technical questions
+
+Respond with JSON in this format:
+{
+    "needs_delegation": true/false,
+    "recommended_agent": "agent_type" or null,
+    "reasoning": "explanation of decision",
+    "task_type": "description of task category"
+}
+
+Consider delegation if the request involves:
+- Scheduling, calendar, or time-based activities
+- Need for current/real-time information or web search
+- Programming, coding, or technical development questions
+
+Respond directly (no delegation) for:
+- General conversation
+- Simple questions you can answer directly
+- Personal advice or opinions
+- Creative writing or brainstorming"""
 
 class PersonalAssistantAgent(BaseAgent):
     """
@@ -37,17 +126,46 @@ class PersonalAssistantAgent(BaseAgent):
     
     def __init__(self, bedrock_service, tools_service=None):
         super().__init__("personal_assistant", bedrock_service, tools_service)
-        self.available_agents = {}
+        # Registered specialist classes by agent type; instances are built lazily
+        self.available_agents: Dict[str, Type[BaseAgent]] = {}
+        self._agent_instances: Dict[str, BaseAgent] = {}
+        self._agent_factories: Dict[str, Callable[[], BaseAgent]] = {}
+        self._delegation_cache = ResponseCache()
+        self._agent_vectors: Dict[str, Dict[str, float]] = {}
+        self.speculative_direct = config.CONFIG.SPECULATIVE_DIRECT_RESPONSE
         
     def register_agent(self, agent):
-        """Register a specialized agent"""
-        self.available_agents[agent.agent_type] = agent
-        self.logger.info(f"Registered agent: {agent.agent_type}")
+        """Register an already built specialized agent"""
+        self._agent_instances[agent.agent_type] = agent
+        self._register(agent.agent_type, type(agent))
+    
+    def register_agent_factory(self, agent_type: str, agent_class: Type[BaseAgent], factory: Callable[[], BaseAgent]):
+        """Register a specialized agent that is only built the first time a task is delegated to it"""
+        self._agent_factories[agent_type] = factory
+        self._register(agent_type, agent_class)
+    
+    def _register(self, agent_type: str, agent_class: Type[BaseAgent]):
+        self.available_agents[agent_type] = agent_class
+        # Capability descriptions are static, so their vector is built once here.
+        # KEYWORDS are left out: they are mostly generic single words.
+        self._agent_vectors[agent_type] = _term_vector(" ".join(agent_class.CAPABILITIES))
+        # The system prompt lists registered agents, so it must be rebuilt, and
+        # earlier routing decisions may no longer be the best ones
+        self.invalidate_system_prompt()
+        self._delegation_cache.clear()
+        self.logger.info(f"Registered agent: {agent_type}")
+    
+    def get_agent(self, agent_type: str) -> Optional[BaseAgent]:
+        """Return the registered agent for agent_type, building it on first use"""
+        agent = self._agent_instances.get(agent_type)
+        if agent is None and agent_type in self._agent_factories:
+            agent = self._agent_instances[agent_type] = self._agent_factories[agent_type]()
+        return agent
         
     def get_system_prompt(self) -> str:
         agent_capabilities = []
-        for agent_type, agent in self.available_agents.items():
-            capabilities = agent.get_capabilities()
+        for agent_type, agent_class in self.available_agents.items():
+            capabilities = agent_class.CAPABILITIES
             agent_capabilities.append(f"- {agent_type}: {', '.join(capabilities)}")
         
         capabilities_text = "\n".join(agent_capabilities)
@@ -76,6 +194,11 @@ Be helpful, conversational, and proactive in understanding user needs."""
     async def process_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Process task by either delegating to specialized agents or handling directly"""
         try:
+            await self._maybe_compact_history(context)
+            
+            if self.speculative_direct and self._quick_delegation(task) is None:
+                return await self._process_speculatively(task, context)
+            
             # Analyze the task to determine if delegation is needed
             delegation_decision = await self._analyze_delegation_need(task, context)
             
@@ -90,47 +213,75 @@ Be helpful, conversational, and proactive in understanding user needs."""
             self.logger.error(f"Error processing task: {str(e)}")
             return self.format_error(f"I encountered an error while processing your request: {str(e)}")
     
+    async def _maybe_compact_history(self, context: Dict[str, Any]):
+        """
+        Summarize turns that have fallen, or will soon fall, out of the history window.
+        
+        Runs only once the conversation exceeds HISTORY_COMPACTION_TOKENS. The
+        summary and the timestamp of the newest message it covers are kept in
+        the session's global context, so each message is summarized once even
+        after old messages are dropped from the bounded history.
+        
+        Compaction is batched: when unsummarized turns start falling out of
+        the window, the summary is extended half a window past them, so the
+        next MAX_HISTORY_MESSAGES // 2 messages can drop out without another
+        Bedrock call.
+        """
+        history = context.get('messages') or []
+        global_context = context.get('global_context')
+        if global_context is None or self.estimate_tokens(history) <= config.CONFIG.HISTORY_COMPACTION_TOKENS:
+            return
+        
+        window_start = max(len(history) - self.MAX_HISTORY_MESSAGES, 0)
+        covered = bisect.bisect_right(
+            history, global_context.get('summary_through', ''),
+            key=lambda message: message.get('timestamp', '')
+        )
+        if covered >= window_start:
+            return
+        older = history[covered:window_start + self.MAX_HISTORY_MESSAGES // 2]
+        
+        try:
+            transcript = "\n".join(f"{message.get('role')}: {message.get('content')}" for message in older)
+            previous = global_context.get('conversation_summary')
+            prompt = (
+                (f"Existing summary:\n{previous}\n\n" if previous else "")
+                + f"New dialogue:\n{transcript}\n\n"
+                + "Update the summary of this conversation in under 200 words, preserving user preferences, "
+                "facts the user shared and open action items. Reply with the summary only."
+            )
+            # Deterministic, so an identical compaction is answered from the response cache
+            summary = await self.generate_response([{"role": "user", "content": prompt}], max_tokens=300, temperature=0)
+            
+            global_context['conversation_summary'] = summary.strip()
+            global_context['summary_through'] = older[-1].get('timestamp', '')
+            self.logger.debug(f"Compacted {len(older)} messages into the conversation summary")
+            
+        except Exception as e:
+            # The bounded history window still applies, so compaction can wait a turn
+            self.logger.warning(f"Error compacting conversation history: {str(e)}")
+    
     async def _analyze_delegation_need(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze if the task needs to be delegated to specialized agents"""
         
-        # Create a prompt to analyze the task
-        analysis_prompt = f"""Analyze this user request and determine if it needs specialized agent assistance:
-
-User Request: "{task}"
-
-Available Specialized Agents:
-- calendar_agent: Schedule management, event creation, meeting planning, date/time queries
-- search_agent: Web search, current information, research questions, factual queries
-- code_assistant: Programming help, code generation, debugging, technical questions
-
-Respond with JSON in this format:
-{{
-    "needs_delegation": true/false,
-    "recommended_agent": "agent_type" or null,
-    "reasoning": "explanation of decision",
-    "task_type": "description of task category"
-}}
-
-Consider delegation if the request involves:
-- Scheduling, calendar, or time-based activities
-- Need for current/real-time information or web search
-- Programming, coding, or technical development questions
-
-Respond directly (no delegation) for:
-- General conversation
-- Simple questions you can answer directly
-- Personal advice or opinions
-- Creative writing or brainstorming"""
-
+        quick_decision = self._quick_delegation(task)
+        if quick_decision is not None:
+            return quick_decision
+        
         try:
-            messages = [{"role": "user", "content": analysis_prompt}]
+            # Static instructions first so they form a stable cacheable prefix
+            messages = [{"role": "user", "content": [
+                {"type": "text", "text": _DELEGATION_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": f'User Request: "{task}"'}
+            ]}]
             response = await self.generate_response(messages, max_tokens=300)
             
-            # Parse JSON response
-            analysis = json.loads(response.strip())
+            # Parse the JSON object, tolerating any chatter around it
+            analysis = json_utils.loads(response[response.find("{"):response.rfind("}") + 1])
+            self._delegation_cache.add(routing_key(task), analysis)
             return analysis
             
-        except (json.JSONDecodeError, Exception) as e:
+        except (json_utils.JSONDecodeError, Exception) as e:
             self.logger.warning(f"Error analyzing delegation need: {str(e)}")
             # Default to no delegation if analysis fails
             return {
@@ -140,13 +291,95 @@ Respond directly (no delegation) for:
                 "task_type": "general"
             }
     
+    async def _process_speculatively(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run the delegation analysis and a direct answer concurrently.
+        
+        Most turns are not delegated, so the direct answer is usually the one
+        returned and the routing call's latency is hidden behind it. When the
+        analysis does pick a specialist, the direct answer is cancelled.
+        """
+        direct_task = asyncio.create_task(self._handle_directly(task, context))
+        try:
+            delegation_decision = await self._analyze_delegation_need(task, context)
+        except BaseException:
+            direct_task.cancel()
+            raise
+        
+        if not delegation_decision.get('needs_delegation'):
+            return await direct_task
+        
+        direct_task.cancel()
+        return await self._delegate_task(task, context, delegation_decision)
+    
+    def _quick_delegation(self, task: str) -> Optional[Dict[str, Any]]:
+        """Return a delegation decision available without an LLM call, if any"""
+        # Unambiguous requests are routed by keyword
+        keyword_decision = self._route_by_keywords(task)
+        if keyword_decision is not None:
+            return keyword_decision
+        
+        cached = self._delegation_cache.get(routing_key(task))
+        if cached is not None:
+            self.logger.debug("Delegation analysis cache hit")
+            return cached
+        
+        return self._route_by_similarity(task)
+    
+    def _route_by_similarity(self, task: str) -> Optional[Dict[str, Any]]:
+        """Return a delegation decision if one agent's capabilities clearly match the task"""
+        task_vector = _term_vector(task)
+        if not task_vector or not self._agent_vectors:
+            return None
+        
+        scores = sorted(
+            (
+                (
+                    sum(weight * vector.get(term, 0.0) for term, weight in task_vector.items()),
+                    sum(1 for term in task_vector if term in vector),
+                    agent_type
+                )
+                for agent_type, vector in self._agent_vectors.items()
+            ),
+            reverse=True
+        )
+        best_score, shared_terms, best_agent = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        if (shared_terms < _SIMILARITY_MIN_TERMS or best_score < _SIMILARITY_THRESHOLD
+                or best_score - runner_up < _SIMILARITY_MARGIN):
+            return None
+        
+        return {
+            "needs_delegation": True,
+            "recommended_agent": best_agent,
+            "reasoning": f"Request is most similar to {best_agent} capabilities ({best_score:.2f})",
+            "task_type": best_agent
+        }
+    
+    def _route_by_keywords(self, task: str) -> Optional[Dict[str, Any]]:
+        """Return a delegation decision if the task names exactly one registered specialist"""
+        matched = {match.lastgroup for match in _ROUTER_RE.finditer(task)}
+        if len(matched) != 1:
+            return None
+        
+        agent_type = matched.pop()
+        if agent_type not in self.available_agents:
+            return None
+        
+        return {
+            "needs_delegation": True,
+            "recommended_agent": agent_type,
+            "reasoning": f"Request matches {agent_type} keywords",
+            "task_type": agent_type
+        }
+    
     async def _delegate_task(self, task: str, context: Dict[str, Any], delegation_decision: Dict[str, Any]) -> Dict[str, Any]:
         """Delegate task to appropriate specialized agent"""
         
         recommended_agent = delegation_decision.get('recommended_agent')
         
         if recommended_agent and recommended_agent in self.available_agents:
-            agent = self.available_agents[recommended_agent]
+            agent = self.get_agent(recommended_agent)
             
             # Check if the agent can handle this task
             if agent.can_handle(task, context):
@@ -168,11 +401,9 @@ Respond directly (no delegation) for:
         """Handle the task directly as a general assistant"""
         
         try:
-            # Get conversation history from context
-            messages = context.get('messages', [])
-            
-            # Add the current user message
-            messages.append({"role": "user", "content": task})
+            # Conversation history plus the current user message; the shared
+            # context is left untouched since this may run speculatively
+            messages = self.build_messages(context, task)
             
             # Generate response
             response = await self.generate_response(messages)
@@ -195,8 +426,7 @@ Respond directly (no delegation) for:
         ]
         
         # Add capabilities from registered agents
-        for agent in self.available_agents.values():
-            agent_caps = agent.get_capabilities()
-            capabilities.extend([f"{cap} (via {agent.agent_type})" for cap in agent_caps])
+        for agent_type, agent_class in self.available_agents.items():
+            capabilities.extend([f"{cap} (via {agent_type})" for cap in agent_class.CAPABILITIES])
             
         return capabilities
@@ -1,13 +1,103 @@
+import asyncio
+import functools
 import logging
-from typing import Dict, Any, List
-from .base_agent import BaseAgent
+import threading
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
+from .base_agent import BaseAgent, ResponseCache, routing_key
+import config
+
+# Words that do not change which results a search returns. Freshness words
+# ("today", "now", "current") are kept: they change the answer and its TTL.
+_QUERY_NOISE_WORDS = frozenset((
+    'what', 'whats', 'is', 'are', 's', 'in', 'of', 'on', 'at',
+    'right', 'tell', 'about', 'show', 'find', 'search'
+))
+
+_SEARCH_SYSTEM_PROMPT = "You are a helpful assistant that provides accurate, current information. Be concise but comprehensive. Include relevant details and cite sources when appropriate."
+
+# Tool used to ask for likely follow-up searches when prefetching
+_FOLLOW_UP_TOOL = {
+    "name": "suggest_follow_up_searches",
+    "description": "Record the web searches the user is most likely to ask for next.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "queries": {
+                "type": "array",
+                "items": {"type": "string"},
+                "maxItems": 2,
+                "description": "Up to two short, self-contained search queries"
+            }
+        },
+        "required": ["queries"]
+    }
+}
+
+def _fmt_citations(citations: List[str]) -> str:
+    """Numbered source list for the top 5 citations; the chat UI links bare URLs"""
+    return "\n".join(f"{i}. {citation}" for i, citation in enumerate(citations[:5], 1))
 
 class SearchAgent(BaseAgent):
     """Specialized agent for web search and information retrieval using Perplexity"""
     
+    KEYWORDS = (
+        'search', 'find', 'look up', 'research', 'what is', 'who is',
+        'when did', 'where is', 'how much', 'latest', 'current',
+        'news', 'recent', 'today', 'information about', 'tell me about',
+        'weather', 'stock', 'price', 'compare', 'reviews', 'facts'
+    )
+    _KEYWORD_PATTERN = BaseAgent.compile_keywords(KEYWORDS)
+    
+    CAPABILITIES = (
+        "Web search for current information",
+        "Research assistance and fact-finding",
+        "News and current events updates",
+        "Market data and pricing information",
+        "Weather and location-based queries",
+        "Comparative analysis and reviews",
+        "Source verification and citation"
+    )
+    
+    # Keywords that typically require web search
+    CURRENT_INFO_KEYWORDS = (
+        'current', 'latest', 'recent', 'today', 'now', 'news',
+        'weather', 'stock', 'price', 'market', 'update',
+        'this year', 'this month', 'this week'
+    )
+    
+    # Topics that often need current information
+    TIME_SENSITIVE_TOPICS = (
+        'weather', 'stocks', 'news', 'events', 'prices',
+        'schedule', 'status', 'availability', 'hours'
+    )
+    
+    # Question phrasings that often need current information
+    QUESTION_PATTERNS = ('what is the current', 'what are the latest', 'how much does', 'when is the next')
+    
+    _SEARCH_NEED_PATTERN = BaseAgent.compile_keywords(CURRENT_INFO_KEYWORDS + TIME_SENSITIVE_TOPICS + QUESTION_PATTERNS)
+    _CURRENT_INFO_PATTERN = BaseAgent.compile_keywords(CURRENT_INFO_KEYWORDS)
+    
+    DIRECT_RESPONSE_NOTE = (
+        "Note: You are responding based on your training data and do not have access to current web "
+        "information for this response. If the user needs current/live information, suggest they ask for a web search."
+    )
+    
+    # Results for current-information queries go stale quickly; factual ones do not
+    CURRENT_RESULT_TTL = timedelta(minutes=5)
+    FACTUAL_RESULT_TTL = timedelta(hours=24)
+    
     def __init__(self, bedrock_service, perplexity_service, tools_service=None):
         super().__init__("search_agent", bedrock_service, tools_service)
         self.perplexity_service = perplexity_service
+        self._result_cache = ResponseCache(max_entries=1024, ttl=self.FACTUAL_RESULT_TTL)
+        
+        # Follow-up prefetching is opt-in and bounded so it never competes
+        # with user-facing requests for more than a couple of slots
+        self.prefetch_enabled = config.CONFIG.SEARCH_PREFETCH
+        self._prefetch_slots = threading.BoundedSemaphore(config.CONFIG.SEARCH_PREFETCH_CONCURRENCY)
+        self._prefetch_tasks = set()
+        self._direct_system_blocks: Optional[List[Dict[str, Any]]] = None
         
     def get_system_prompt(self) -> str:
         return """You are a Search Assistant AI specialized in finding and providing current information from the web.
@@ -34,21 +124,13 @@ For search queries, be precise and use appropriate keywords to get the best resu
 
     def can_handle(self, task: str, context: Dict[str, Any]) -> bool:
         """Determine if this is a search-related task"""
-        search_keywords = [
-            'search', 'find', 'look up', 'research', 'what is', 'who is',
-            'when did', 'where is', 'how much', 'latest', 'current',
-            'news', 'recent', 'today', 'information about', 'tell me about',
-            'weather', 'stock', 'price', 'compare', 'reviews', 'facts'
-        ]
-        
-        task_lower = task.lower()
-        return any(keyword in task_lower for keyword in search_keywords)
+        return self._KEYWORD_PATTERN.search(task) is not None
     
     async def process_task(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Process search-related tasks using Perplexity API"""
         try:
             # Determine if this needs a web search or can be answered directly
-            needs_search = await self._analyze_search_need(task, context)
+            needs_search = self._classify_search_need(task)
             
             if needs_search:
                 return await self._perform_web_search(task, context)
@@ -59,39 +141,18 @@ For search queries, be precise and use appropriate keywords to get the best resu
             self.logger.error(f"Error processing search task: {str(e)}")
             return self.format_error(f"I encountered an error while searching for information: {str(e)}")
     
-    async def _analyze_search_need(self, task: str, context: Dict[str, Any]) -> bool:
-        """Analyze if the task requires web search for current information"""
-        
-        # Keywords that typically require web search
-        current_info_keywords = [
-            'current', 'latest', 'recent', 'today', 'now', 'news',
-            'weather', 'stock', 'price', 'market', 'update',
-            'this year', 'this month', 'this week'
-        ]
-        
-        # Topics that often need current information
-        time_sensitive_topics = [
-            'weather', 'stocks', 'news', 'events', 'prices',
-            'schedule', 'status', 'availability', 'hours'
-        ]
-        
-        task_lower = task.lower()
+    @staticmethod
+    @functools.lru_cache(maxsize=2048)
+    def _classify_search_need(task: str) -> bool:
+        """Decide if the task requires web search for current information (pure, memoized)"""
         
-        # Check for explicit current information requests
-        if any(keyword in task_lower for keyword in current_info_keywords):
-            return True
-            
-        # Check for time-sensitive topics
-        if any(topic in task_lower for topic in time_sensitive_topics):
-            return True
-            
-        # Check for question words that often need current info
-        question_patterns = ['what is the current', 'what are the latest', 'how much does', 'when is the next']
-        if any(pattern in task_lower for pattern in question_patterns):
+        # Explicit current-information requests, time-sensitive topics and
+        # question phrasings all lead to a search, so one scan covers them
+        if SearchAgent._SEARCH_NEED_PATTERN.search(task):
             return True
             
         # Default to search for factual questions
-        if task_lower.startswith(('what', 'who', 'when', 'where', 'how', 'which')):
+        if task.lstrip().lower().startswith(('what', 'who', 'when', 'where', 'how', 'which')):
             return True
             
         return False
@@ -99,22 +160,27 @@ For search queries, be precise and use appropriate keywords to get the best resu
     async def _perform_web_search(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Perform web search using Perplexity API"""
         try:
-            # Use Perplexity for web search
-            search_result = await self.perplexity_service.search(
-                query=task,
-                system_prompt="You are a helpful assistant that provides accurate, current information. Be concise but comprehensive. Include relevant details and cite sources when appropriate."
-            )
+            cache_key = self._search_cache_key(task)
+            cached = self._result_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                self.logger.debug("Search result cache hit")
+                search_result = {'success': True, 'content': cached[0], 'citations': cached[1]}
+            else:
+                # Use Perplexity for web search
+                search_result = await self.perplexity_service.search(
+                    query=task, system_prompt=_SEARCH_SYSTEM_PROMPT, cache_ttl=self._result_ttl(task).total_seconds()
+                )
             
             if search_result.get('success'):
                 content = search_result.get('content', '')
                 citations = search_result.get('citations', [])
                 
+                if cached is None:
+                    self._cache_search_result(task, content, citations)
+                    self._schedule_prefetch(task)
+                
                 # Format the response with citations
-                formatted_response = content
-                if citations:
-                    formatted_response += "\n\n**Sources:**\n"
-                    for i, citation in enumerate(citations[:5], 1):  # Limit to top 5 citations
-                        formatted_response += f"{i}. {citation}\n"
+                formatted_response = f"{content}\n\n**Sources:**\n{_fmt_citations(citations)}\n" if citations else content
                 
                 return self.format_response(
                     formatted_response,
@@ -134,19 +200,81 @@ For search queries, be precise and use appropriate keywords to get the best resu
             # Fallback to direct response
             return await self._handle_direct_response(task, context)
     
-    async def _handle_direct_response(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
-        """Handle the task with direct AI response (no web search)"""
+    def _cache_search_result(self, query: str, content: str, citations: List[str]):
+        """Store a successful search result with a TTL matching how fast it goes stale"""
+        cache_key = self._search_cache_key(query)
+        if not cache_key:
+            return
+        self._result_cache.add(cache_key, (content, citations), ttl=self._result_ttl(query))
+    
+    def _result_ttl(self, query: str) -> timedelta:
+        """How long results for a query stay fresh; also passed on to the Perplexity cache"""
+        return self.CURRENT_RESULT_TTL if self._CURRENT_INFO_PATTERN.search(query) else self.FACTUAL_RESULT_TTL
+    
+    def _schedule_prefetch(self, task: str):
+        """Start prefetching likely follow-up searches in the background, if a slot is free"""
+        if not self.prefetch_enabled or not self._prefetch_slots.acquire(blocking=False):
+            return
+        prefetch = asyncio.get_running_loop().create_task(self._prefetch_follow_ups(task))
+        self._prefetch_tasks.add(prefetch)
+        prefetch.add_done_callback(self._prefetch_done)
+    
+    def _prefetch_done(self, prefetch: asyncio.Task):
+        self._prefetch_tasks.discard(prefetch)
+        self._prefetch_slots.release()
+    
+    async def _prefetch_follow_ups(self, task: str):
+        """Search likely follow-up queries now so the user's next turn is a cache hit"""
         try:
-            messages = context.get('messages', [])
-            messages.append({"role": "user", "content": task})
+            messages = [{"role": "user", "content": f'The user just searched for: "{task}". Suggest the searches they are most likely to ask for next.'}]
+            suggestion = await self.generate_structured_response(messages, _FOLLOW_UP_TOOL, max_tokens=150)
             
-            # Add context about not having current web data
-            enhanced_messages = messages + [{
-                "role": "system", 
-                "content": "Note: You are responding based on your training data and do not have access to current web information for this response. If the user needs current/live information, suggest they ask for a web search."
+            for query in suggestion.get('queries', [])[:2]:
+                cache_key = self._search_cache_key(query)
+                if not cache_key or self._result_cache.get(cache_key) is not None:
+                    continue
+                result = await self.perplexity_service.search(
+                    query=query, system_prompt=_SEARCH_SYSTEM_PROMPT, cache_ttl=self._result_ttl(query).total_seconds()
+                )
+                if result.get('success'):
+                    self._cache_search_result(query, result.get('content', ''), result.get('citations', []))
+                    
+        except Exception as e:
+            self.logger.debug(f"Search prefetch failed: {str(e)}")
+    
+    @classmethod
+    def _search_cache_key(cls, task: str):
+        """
+        Key search results so light rephrasings of the same query share an entry.
+        
+        Noise words are dropped ("what is the weather in Paris" and "weather
+        Paris" match) but word order is kept, since it can change the meaning,
+        and so are freshness words. The key also records whether the query is
+        a current-information one, so an entry is only ever served to queries
+        with the same TTL as the one that stored it.
+        """
+        terms = tuple(term for term in routing_key(task) if term not in _QUERY_NOISE_WORDS)
+        if not terms:
+            return None
+        return (cls._CURRENT_INFO_PATTERN.search(task) is not None, terms)
+    
+    def _direct_response_system_blocks(self) -> List[Dict[str, Any]]:
+        """System prompt plus the training-data note, built once so it stays byte-identical"""
+        if self._direct_system_blocks is None:
+            self._direct_system_blocks = [{
+                "type": "text",
+                "text": f"{self.system_prompt}\n\n{self.DIRECT_RESPONSE_NOTE}",
+                "cache_control": {"type": "ephemeral"}
             }]
+        return self._direct_system_blocks
+    
+    async def _handle_direct_response(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle the task with direct AI response (no web search)"""
+        try:
+            messages = self.build_messages(context, task)
             
-            response = await self.generate_response(enhanced_messages)
+            # The training-data note goes in the system prompt, not in messages
+            response = await self.generate_response(messages, system_prompt_blocks=self._direct_response_system_blocks())
             
             return self.format_response(
                 response,
@@ -160,26 +288,3 @@ For search queries, be precise and use appropriate keywords to get the best resu
         except Exception as e:
             self.logger.error(f"Error handling direct response: {str(e)}")
             return self.format_error(f"Failed to process your request: {str(e)}")
-    
-    async def _format_search_response(self, search_result: str, citations: List[str]) -> str:
-        """Format search results with proper citations"""
-        formatted_response = search_result
-        
-        if citations:
-            formatted_response += "\n\n**Sources:**\n"
-            for i, citation in enumerate(citations[:5], 1):  # Limit to 5 citations
-                formatted_response += f"{i}. [{citation}]({citation})\n"
-        
-        return formatted_response
-    
-    def get_capabilities(self) -> List[str]:
-        """Return search agent capabilities"""
-        return [
-            "Web search for current information",
-            "Research assistance and fact-finding",
-            "News and current events updates",
-            "Market data and pricing information",
-            "Weather and location-based queries",
-            "Comparative analysis and reviews",
-            "Source verification and citation"
-        ]
@@ -1,9 +1,10 @@
-import os
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from config import CONFIG
+from json_provider import FastJSONProvider
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -15,11 +16,12 @@ db = SQLAlchemy(model_class=Base)
 
 # Create the app
 app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
+app.json = FastJSONProvider(app)
+app.secret_key = CONFIG.SECRET_KEY
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///assistant.db")
+app.config["SQLALCHEMY_DATABASE_URI"] = CONFIG.DATABASE_URL
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
@@ -31,7 +33,7 @@ db.init_app(app)
 
 # Import routes
 from routes.main import main_bp
-from routes.api import api_bp
+from routes.api import api_bp, get_workflow
 
 app.register_blueprint(main_bp)
 app.register_blueprint(api_bp, url_prefix='/api')
@@ -42,5 +44,8 @@ with app.app_context():
     db.create_all()
     logging.info("Database tables created successfully")
 
+# Build the shared workflow now so the first request doesn't pay for it
+get_workflow()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,25 +1,50 @@
 import os
+from dataclasses import dataclass, field
+from typing import Optional
 
+# Environment variables are read once, when this module is imported; the
+# resulting values live on the frozen CONFIG singleton below
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() == 'true'
+
+@dataclass(frozen=True, slots=True)
 class Config:
     # AWS Bedrock Configuration
-    AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
-    AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
-    AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
-    
+    AWS_REGION: str = os.environ.get('AWS_REGION', 'us-east-1')
+    AWS_ACCESS_KEY_ID: Optional[str] = os.environ.get('AWS_ACCESS_KEY_ID')
+    AWS_SECRET_ACCESS_KEY: Optional[str] = field(default=os.environ.get('AWS_SECRET_ACCESS_KEY'), repr=False)
+
     # Bedrock Model Configuration
-    BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-sonnet-20241022-v2:0')
-    
+    BEDROCK_MODEL_ID: str = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-sonnet-20241022-v2:0')
+    DISABLE_PROMPT_CACHING: bool = _env_flag('DISABLE_PROMPT_CACHING', 'False')
+    BEDROCK_MAX_CONCURRENCY: int = int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '8'))
+    BEDROCK_RESPONSE_CACHE_TTL: int = int(os.environ.get('BEDROCK_RESPONSE_CACHE_TTL', '0'))  # seconds; temperature 0 only, 0 disables
+
     # Perplexity Configuration
-    PERPLEXITY_API_KEY = os.environ.get('PERPLEXITY_API_KEY')
-    PERPLEXITY_MODEL = 'llama-3.1-sonar-small-128k-online'
-    
+    PERPLEXITY_API_KEY: Optional[str] = field(default=os.environ.get('PERPLEXITY_API_KEY'), repr=False)
+    PERPLEXITY_MODEL: str = 'llama-3.1-sonar-small-128k-online'
+    PERPLEXITY_CACHE_TTL: int = int(os.environ.get('PERPLEXITY_CACHE_TTL', '300'))  # seconds, unless the caller passes one; 0 disables
+
     # Database Configuration
-    DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///assistant.db')
-    
+    DATABASE_URL: str = os.environ.get('DATABASE_URL', 'sqlite:///assistant.db')
+
     # Flask Configuration
-    SECRET_KEY = os.environ.get('SESSION_SECRET', 'dev-secret-key-change-in-production')
-    DEBUG = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
-    
+    SECRET_KEY: str = field(default=os.environ.get('SESSION_SECRET', 'dev-secret-key-change-in-production'), repr=False)
+    DEBUG: bool = _env_flag('FLASK_DEBUG', 'True')
+
     # Agent Configuration
-    MAX_AGENT_ITERATIONS = int(os.environ.get('MAX_AGENT_ITERATIONS', '10'))
-    AGENT_TIMEOUT = int(os.environ.get('AGENT_TIMEOUT', '30'))
+    MAX_AGENT_ITERATIONS: int = int(os.environ.get('MAX_AGENT_ITERATIONS', '10'))
+    AGENT_TIMEOUT: int = int(os.environ.get('AGENT_TIMEOUT', '30'))
+    MAX_HISTORY_MESSAGES: int = int(os.environ.get('MAX_HISTORY_MESSAGES', '16'))  # 8 user/assistant turns
+    MAX_AGENT_MESSAGES: int = int(os.environ.get('MAX_AGENT_MESSAGES', '200'))  # stored per session
+    MAX_WORKFLOW_EVENTS: int = int(os.environ.get('MAX_WORKFLOW_EVENTS', '500'))
+    MAX_ACTIVE_WORKFLOWS: int = int(os.environ.get('MAX_ACTIVE_WORKFLOWS', '1024'))  # kept in memory
+    HISTORY_COMPACTION_TOKENS: int = int(os.environ.get('HISTORY_COMPACTION_TOKENS', '4000'))
+    SPECULATIVE_DIRECT_RESPONSE: bool = _env_flag('SPECULATIVE_DIRECT_RESPONSE', 'False')
+    SEARCH_PREFETCH: bool = _env_flag('SEARCH_PREFETCH', 'False')
+    SEARCH_PREFETCH_CONCURRENCY: int = int(os.environ.get('SEARCH_PREFETCH_CONCURRENCY', '2'))
+    LIST_EVENTS_CACHE_TTL: int = int(os.environ.get('LIST_EVENTS_CACHE_TTL', '60'))  # seconds; 0 disables
+    HEALTH_CHECK_TTL: int = int(os.environ.get('HEALTH_CHECK_TTL', '5'))  # seconds
+
+CONFIG = Config()
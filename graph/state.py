@@ -1,51 +1,101 @@
-import json
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass, asdict
-from datetime import datetime
+import bisect
+import heapq
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Any, List, Optional
+from dataclasses import MISSING, dataclass, field, fields
 
-@dataclass
+import json_utils
+import config
+from agents.base_agent import utc_now_iso
+
+@dataclass(slots=True)
 class AgentState:
     """State for individual agents"""
     agent_type: str
     session_id: str
     context: Dict[str, Any]
-    messages: List[Dict[str, str]]
+    messages: Deque[Dict[str, str]]
     last_action: Optional[str] = None
     last_result: Optional[Dict[str, Any]] = None
     error_count: int = 0
     
+    def __post_init__(self):
+        """Keep only the most recent messages"""
+        self.messages = _bounded(self.messages, config.CONFIG.MAX_AGENT_MESSAGES)
+    
     def to_dict(self) -> Dict[str, Any]:
-        """Convert to dictionary for serialization"""
-        return asdict(self)
+        """
+        Convert to dictionary for serialization.
+        
+        Unlike asdict() nothing is deep-copied: the result shares the context
+        and message dicts with this state, so serialize it before mutating.
+        """
+        return {
+            "agent_type": self.agent_type,
+            "session_id": self.session_id,
+            "context": self.context,
+            "messages": list(self.messages),
+            "last_action": self.last_action,
+            "last_result": self.last_result,
+            "error_count": self.error_count
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'AgentState':
-        """Create from dictionary"""
-        return cls(**data)
+        """Create from dictionary without re-running __init__"""
+        obj = object.__new__(cls)
+        _get = data.get
+        for name, default in _AGENT_STATE_FIELDS:
+            object.__setattr__(obj, name, data[name] if default is MISSING else _get(name, default))
+        obj.messages = _bounded(obj.messages, config.CONFIG.MAX_AGENT_MESSAGES)
+        return obj
     
     def add_message(self, role: str, content: str):
         """Add a message to the conversation"""
         self.messages.append({
             "role": role,
             "content": content,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": utc_now_iso()
         })
     
     def get_recent_messages(self, count: int = 10) -> List[Dict[str, str]]:
         """Get recent messages for context"""
-        return self.messages[-count:] if self.messages else []
+        recent = list(islice(reversed(self.messages), count))
+        recent.reverse()
+        return recent
+
+def _bounded(items, maxlen: int) -> deque:
+    """Wrap items in a deque that keeps only the last maxlen entries"""
+    if isinstance(items, deque) and items.maxlen == maxlen:
+        return items
+    return deque(items or (), maxlen=maxlen)
+
+# (name, default) per field, computed once; MISSING marks a required field
+_AGENT_STATE_FIELDS = tuple((f.name, f.default) for f in fields(AgentState))
 
-@dataclass 
+def _message_timestamp(message: Dict[str, Any]) -> str:
+    return message.get('timestamp', '')
+
+@dataclass(slots=True)
 class WorkflowState:
     """Overall workflow state for multi-agent coordination"""
     session_id: str
     current_agent: Optional[str] = None
     agent_states: Dict[str, AgentState] = None
     global_context: Dict[str, Any] = None
-    workflow_history: List[Dict[str, Any]] = None
+    workflow_history: Deque[Dict[str, Any]] = None
     iteration_count: int = 0
     is_complete: bool = False
     final_result: Optional[Dict[str, Any]] = None
+    # Incremented on every workflow event so clients can tell if their copy is stale
+    version: int = 0
+    # Merged, timestamp-ordered view of all agents' messages and the newest
+    # message of each agent it already contains; not part of the serialized state
+    _merged_history: List[Dict[str, Any]] = field(default_factory=list, init=False, repr=False, compare=False)
+    _merged_tails: Dict[str, Dict[str, Any]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # Context dict handed to the coordinator, reused from turn to turn
+    turn_context: Dict[str, Any] = field(default_factory=dict, init=False, repr=False, compare=False)
     
     def __post_init__(self):
         """Initialize mutable fields"""
@@ -53,8 +103,7 @@ class WorkflowState:
             self.agent_states = {}
         if self.global_context is None:
             self.global_context = {}
-        if self.workflow_history is None:
-            self.workflow_history = []
+        self.workflow_history = _bounded(self.workflow_history, config.CONFIG.MAX_WORKFLOW_EVENTS)
     
     def get_agent_state(self, agent_type: str) -> Optional[AgentState]:
         """Get state for a specific agent"""
@@ -63,73 +112,135 @@ class WorkflowState:
     def set_agent_state(self, agent_type: str, state: AgentState):
         """Set state for a specific agent"""
         self.agent_states[agent_type] = state
+        self._reset_history()
     
     def add_workflow_event(self, event_type: str, agent_type: str, data: Dict[str, Any]):
         """Add an event to the workflow history"""
         event = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": utc_now_iso(),
             "event_type": event_type,
             "agent_type": agent_type,
             "iteration": self.iteration_count,
             "data": data
         }
         self.workflow_history.append(event)
+        self.version += 1
     
     def get_conversation_history(self) -> List[Dict[str, str]]:
-        """Get combined conversation history from all agents"""
-        all_messages = []
+        """
+        Get combined conversation history from all agents, sorted by timestamp.
+        
+        Only messages added since the previous call are merged in, so a turn
+        costs O(new messages) rather than re-sorting the whole session. The
+        returned list is shared and must be treated as read-only.
+        """
+        merged = self._merged_history
+        tails = self._merged_tails
+        new_runs = []
         
-        for agent_state in self.agent_states.values():
-            all_messages.extend(agent_state.messages)
+        for agent_type, agent_state in self.agent_states.items():
+            messages = agent_state.messages
+            tail = tails.get(agent_type)
+            if not messages:
+                if tail is not None:
+                    # Messages were cleared behind our back; start over
+                    self._reset_history()
+                    return self.get_conversation_history()
+                continue
+            if messages[-1] is tail:
+                continue
+            
+            # Walk back from the newest message to the last one already merged
+            fresh = []
+            for message in reversed(messages):
+                if message is tail:
+                    break
+                fresh.append(message)
+            else:
+                if tail is not None:
+                    # The last merged message is gone; start over
+                    self._reset_history()
+                    return self.get_conversation_history()
+            fresh.reverse()
+            new_runs.append(fresh)
+            tails[agent_type] = messages[-1]
         
-        # Sort by timestamp if available
-        try:
-            all_messages.sort(key=lambda x: x.get('timestamp', ''))
-        except:
-            # If sorting fails, return as-is
-            pass
+        if new_runs:
+            # Each agent's messages are already in time order, so the runs
+            # only need merging, never a full sort
+            if len(new_runs) == 1:
+                new_messages = new_runs[0]
+            else:
+                new_messages = list(heapq.merge(*new_runs, key=_message_timestamp))
+            
+            start = len(merged)
+            if merged and _message_timestamp(new_messages[0]) < _message_timestamp(merged[-1]):
+                # Re-merge only the part of the history the new messages overlap
+                start = bisect.bisect_right(merged, _message_timestamp(new_messages[0]), key=_message_timestamp)
+            merged[start:] = heapq.merge(merged[start:], new_messages, key=_message_timestamp)
+            
+            excess = len(merged) - config.CONFIG.MAX_AGENT_MESSAGES
+            if excess > 0:
+                del merged[:excess]
             
-        return all_messages
+        return merged
+    
+    def _reset_history(self):
+        """Drop the merged history view so the next read rebuilds it"""
+        self._merged_history = []
+        self._merged_tails = {}
     
     def to_dict(self) -> Dict[str, Any]:
-        """Convert to dictionary for serialization"""
+        """Convert to dictionary for serialization (shares references with this state)"""
         return {
             "session_id": self.session_id,
             "current_agent": self.current_agent,
             "agent_states": {k: v.to_dict() for k, v in self.agent_states.items()},
             "global_context": self.global_context,
-            "workflow_history": self.workflow_history,
+            "workflow_history": list(self.workflow_history),
             "iteration_count": self.iteration_count,
             "is_complete": self.is_complete,
-            "final_result": self.final_result
+            "final_result": self.final_result,
+            "version": self.version
         }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'WorkflowState':
-        """Create from dictionary"""
-        # Convert agent_states dict back to AgentState objects
-        agent_states = {}
-        if "agent_states" in data and data["agent_states"]:
-            for k, v in data["agent_states"].items():
-                agent_states[k] = AgentState.from_dict(v)
+        """Create from dictionary without re-running __init__/__post_init__"""
+        _get = data.get
+        agent_state_from_dict = AgentState.from_dict
         
-        return cls(
-            session_id=data["session_id"],
-            current_agent=data.get("current_agent"),
-            agent_states=agent_states,
-            global_context=data.get("global_context", {}),
-            workflow_history=data.get("workflow_history", []),
-            iteration_count=data.get("iteration_count", 0),
-            is_complete=data.get("is_complete", False),
-            final_result=data.get("final_result")
-        )
+        obj = object.__new__(cls)
+        obj.session_id = data["session_id"]
+        obj.current_agent = _get("current_agent")
+        # Convert agent_states dict back to AgentState objects
+        obj.agent_states = {k: agent_state_from_dict(v) for k, v in (_get("agent_states") or {}).items()}
+        obj.global_context = _get("global_context") or {}
+        obj.workflow_history = _bounded(_get("workflow_history"), config.CONFIG.MAX_WORKFLOW_EVENTS)
+        obj.iteration_count = _get("iteration_count", 0)
+        obj.is_complete = _get("is_complete", False)
+        obj.final_result = _get("final_result")
+        obj.version = _get("version", 0)
+        obj._merged_history = []
+        obj._merged_tails = {}
+        obj.turn_context = {}
+        return obj
+    
+    def to_delta(self) -> Dict[str, Any]:
+        """Small summary of the latest change, for responses that don't need the full state"""
+        return {
+            "iteration_count": self.iteration_count,
+            "current_agent": self.current_agent,
+            "version": self.version,
+            "last_event": self.workflow_history[-1] if self.workflow_history else None
+        }
     
     def serialize(self) -> str:
         """Serialize to JSON string"""
-        return json.dumps(self.to_dict(), default=str)
+        return json_utils.dumps(self.to_dict(), default=json_utils.default)
     
     @classmethod
     def deserialize(cls, json_str: str) -> 'WorkflowState':
         """Deserialize from JSON string"""
-        data = json.loads(json_str)
+        data = json_utils.loads(json_str)
         return cls.from_dict(data)
@@ -1,14 +1,35 @@
 import asyncio
+import functools
 import logging
+import time
 from typing import Dict, Any, Optional, List
 import uuid
-from datetime import datetime
+from collections import OrderedDict
 
 from .state import WorkflowState, AgentState
-from agents import PersonalAssistantAgent, CalendarAgent, SearchAgent, CodeAssistantAgent
+from agents.base_agent import utc_now_iso
+import agents
+from agents import PersonalAssistantAgent, SearchAgent
 from services import BedrockService, PerplexityService, ToolsService
 import config
 
+# Specialized agents, by agent type; each is built the first time it is needed.
+# Classes are looked up by name when a workflow is created, so importing this
+# module does not import CalendarAgent and the database stack behind it.
+_SPECIALIST_CLASS_NAMES = {
+    "calendar_agent": "CalendarAgent",
+    "search_agent": "SearchAgent",
+    "code_assistant": "CodeAssistantAgent"
+}
+
+def _specialist_class(agent_type: str) -> type:
+    return getattr(agents, _SPECIALIST_CLASS_NAMES[agent_type])
+
+logger = logging.getLogger("graph.workflow")
+
+# agent_type under which evicted workflows are stored in the agent_states table
+_STORED_WORKFLOW_TYPE = "workflow"
+
 class MultiAgentWorkflow:
     """
     LangGraph-inspired multi-agent workflow orchestrator.
@@ -31,43 +52,72 @@ class MultiAgentWorkflow:
     """
     
     def __init__(self):
-        self.logger = logging.getLogger("graph.workflow")
+        self.logger = logger
         
-        # Initialize services
+        # Initialize services; Perplexity is only set up once search is used
         self.bedrock_service = BedrockService()
-        self.perplexity_service = PerplexityService()
         self.tools_service = ToolsService()
         
-        # Initialize agents
-        self.agents = self._initialize_agents()
-        self.coordinator = self.agents["personal_assistant"]
+        # Initialize agents; self.agents holds the ones built so far
+        self.agents: Dict[str, Any] = {}
+        self.coordinator = self._initialize_agents()
+        
+        # Capabilities are static once agents are registered, so the agent
+        # listing is built once and shared by /agents and the health check
+        self._agent_info = [
+            {
+                "agent_type": agent_type,
+                "capabilities": self._agent_capabilities(agent_type),
+                "status": "active"
+            }
+            for agent_type in self._agent_types()
+        ]
+        self._capability_counts = {info["agent_type"]: len(info["capabilities"]) for info in self._agent_info}
         
         # Workflow configuration
-        self.max_iterations = config.Config.MAX_AGENT_ITERATIONS
-        self.timeout = config.Config.AGENT_TIMEOUT
+        self.max_iterations = config.CONFIG.MAX_AGENT_ITERATIONS
+        self.timeout = config.CONFIG.AGENT_TIMEOUT
+        
+        # Active workflows, least recently used first; the oldest are saved to
+        # the database once there are more than MAX_ACTIVE_WORKFLOWS
+        self.active_workflows: "OrderedDict[str, WorkflowState]" = OrderedDict()
+        self.max_active_workflows = config.CONFIG.MAX_ACTIVE_WORKFLOWS
+        # Evicted workflows whose save is still running, and loads in flight,
+        # by session; requests in those gaps must get the same state object
+        self._pending_saves: Dict[str, WorkflowState] = {}
+        self._pending_loads: Dict[str, "asyncio.Future[Optional[WorkflowState]]"] = {}
         
-        # Active workflows
-        self.active_workflows: Dict[str, WorkflowState] = {}
+        # (monotonic time, service statuses) from the last health check
+        self._service_health: Optional[tuple] = None
         
         self.logger.info("Multi-agent workflow initialized")
     
-    def _initialize_agents(self) -> Dict[str, Any]:
-        """Initialize all agents"""
-        agents = {}
-        
-        # Initialize specialized agents
-        agents["calendar_agent"] = CalendarAgent(self.bedrock_service, self.tools_service)
-        agents["search_agent"] = SearchAgent(self.bedrock_service, self.perplexity_service, self.tools_service)
-        agents["code_assistant"] = CodeAssistantAgent(self.bedrock_service, self.tools_service)
-        
-        # Initialize coordinator and register specialized agents
+    @functools.cached_property
+    def perplexity_service(self) -> PerplexityService:
+        return PerplexityService()
+    
+    def _initialize_agents(self) -> PersonalAssistantAgent:
+        """Create the coordinator and register the specialized agents without building them"""
         coordinator = PersonalAssistantAgent(self.bedrock_service, self.tools_service)
-        for agent_type, agent in agents.items():
-            coordinator.register_agent(agent)
+        self.agents["personal_assistant"] = coordinator
         
-        agents["personal_assistant"] = coordinator
+        for agent_type in _SPECIALIST_CLASS_NAMES:
+            coordinator.register_agent_factory(agent_type, _specialist_class(agent_type), functools.partial(self.get_agent, agent_type))
         
-        return agents
+        return coordinator
+    
+    def get_agent(self, agent_type: str) -> Any:
+        """Return the agent for agent_type, building it on first use"""
+        agent = self.agents.get(agent_type)
+        if agent is None:
+            agent_class = _specialist_class(agent_type)
+            if agent_class is SearchAgent:
+                agent = SearchAgent(self.bedrock_service, self.perplexity_service, self.tools_service)
+            else:
+                agent = agent_class(self.bedrock_service, self.tools_service)
+            self.agents[agent_type] = agent
+            self.logger.info("Initialized agent: %s", agent_type)
+        return agent
     
     async def process_user_input(self, user_input: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Process user input through the multi-agent workflow"""
@@ -76,7 +126,7 @@ class MultiAgentWorkflow:
         if not session_id:
             session_id = str(uuid.uuid4())
         
-        workflow_state = self._get_or_create_workflow_state(session_id)
+        workflow_state = await self._get_or_create_workflow_state(session_id)
         
         try:
             # Add user input to workflow history
@@ -90,35 +140,36 @@ class MultiAgentWorkflow:
             workflow_state.final_result = result
             
             # Store updated state
-            self.active_workflows[session_id] = workflow_state
+            await self._remember_workflow_state(workflow_state)
             
             return {
                 "success": True,
                 "result": result,
                 "session_id": session_id,
-                "workflow_state": workflow_state.to_dict()
+                "workflow_delta": workflow_state.to_delta()
             }
             
         except Exception as e:
-            self.logger.error(f"Error processing user input: {str(e)}")
+            self.logger.error("Error processing user input: %s", e)
             workflow_state.add_workflow_event("error", "workflow", {"error": str(e)})
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Workflow state on error: %s", workflow_state.serialize())
             
             return {
                 "success": False,
                 "error": str(e),
-                "session_id": session_id,
-                "workflow_state": workflow_state.to_dict()
+                "session_id": session_id
             }
     
     async def _execute_workflow(self, user_input: str, workflow_state: WorkflowState) -> Dict[str, Any]:
         """Execute the main workflow logic"""
         
-        # Prepare context for the coordinator
-        context = {
-            "messages": workflow_state.get_conversation_history(),
-            "global_context": workflow_state.global_context,
-            "session_id": workflow_state.session_id
-        }
+        # Prepare context for the coordinator; the dict is reused across turns
+        # with only the history refreshed
+        context = workflow_state.turn_context
+        context["messages"] = workflow_state.get_conversation_history()
+        context["global_context"] = workflow_state.global_context
+        context["session_id"] = workflow_state.session_id
         
         # Get or create agent state for coordinator
         coordinator_state = workflow_state.get_agent_state("personal_assistant")
@@ -126,7 +177,7 @@ class MultiAgentWorkflow:
             coordinator_state = AgentState(
                 agent_type="personal_assistant",
                 session_id=workflow_state.session_id,
-                context=context,
+                context={"session_id": workflow_state.session_id},
                 messages=[]
             )
             workflow_state.set_agent_state("personal_assistant", coordinator_state)
@@ -151,93 +202,199 @@ class MultiAgentWorkflow:
             return result
             
         except Exception as e:
-            self.logger.error(f"Error in workflow execution: {str(e)}")
+            self.logger.error("Error in workflow execution: %s", e)
             coordinator_state.error_count += 1
             workflow_state.add_workflow_event("agent_error", "personal_assistant", {"error": str(e)})
             raise
     
-    def _get_or_create_workflow_state(self, session_id: str) -> WorkflowState:
+    async def _get_or_create_workflow_state(self, session_id: str) -> WorkflowState:
         """Get existing workflow state or create new one"""
-        if session_id in self.active_workflows:
-            return self.active_workflows[session_id]
+        workflow_state = await self._find_workflow_state(session_id)
+        if workflow_state is None:
+            # Concurrent first requests for a session share its new state
+            workflow_state = self.active_workflows.get(session_id)
+            if workflow_state is None:
+                workflow_state = WorkflowState(session_id=session_id)
+                await self._remember_workflow_state(workflow_state)
+        return workflow_state
+    
+    async def _find_workflow_state(self, session_id: str) -> Optional[WorkflowState]:
+        """Look a workflow up in memory, then among the ones saved to the database"""
+        workflow_state = self.active_workflows.get(session_id)
+        if workflow_state is not None:
+            self.active_workflows.move_to_end(session_id)
+            return workflow_state
+        
+        workflow_state = self._pending_saves.get(session_id)
+        if workflow_state is not None:
+            await self._remember_workflow_state(workflow_state)
+            return workflow_state
+        
+        # Concurrent requests for the same session share one load
+        load = self._pending_loads.get(session_id)
+        if load is None:
+            load = self._pending_loads[session_id] = asyncio.ensure_future(self._load_and_remember(session_id))
+        return await asyncio.shield(load)
+    
+    async def _load_and_remember(self, session_id: str) -> Optional[WorkflowState]:
+        try:
+            # Database calls block, so they run off the shared event loop
+            workflow_state = await asyncio.to_thread(self._load_workflow_state, session_id)
+            if workflow_state is not None:
+                await self._remember_workflow_state(workflow_state)
+            return workflow_state
+        finally:
+            del self._pending_loads[session_id]
+    
+    async def _remember_workflow_state(self, workflow_state: WorkflowState):
+        """Keep a workflow in memory, saving the least recently used ones beyond the limit"""
+        self.active_workflows[workflow_state.session_id] = workflow_state
+        self.active_workflows.move_to_end(workflow_state.session_id)
+        while len(self.active_workflows) > self.max_active_workflows:
+            session_id, evicted = self.active_workflows.popitem(last=False)
+            # Until the save finishes, lookups find the evicted state here
+            # instead of loading an older copy or starting a new one
+            self._pending_saves[session_id] = evicted
+            try:
+                await asyncio.to_thread(self._save_workflow_state, evicted)
+            finally:
+                if self._pending_saves.get(session_id) is evicted:
+                    del self._pending_saves[session_id]
+    
+    def _save_workflow_state(self, workflow_state: WorkflowState):
+        """Upsert a serialized workflow into the agent_states table (blocking)"""
+        from app import db
+        from models import AgentState as StoredAgentState
+        
+        try:
+            row = StoredAgentState.query.filter_by(
+                session_id=workflow_state.session_id, agent_type=_STORED_WORKFLOW_TYPE
+            ).first()
+            if row is None:
+                row = StoredAgentState(session_id=workflow_state.session_id, agent_type=_STORED_WORKFLOW_TYPE)
+                db.session.add(row)
+            row.state_data = workflow_state.serialize()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.logger.error("Error saving workflow for session %s: %s", workflow_state.session_id, e)
+    
+    def _load_workflow_state(self, session_id: str) -> Optional[WorkflowState]:
+        """Restore a workflow saved by _save_workflow_state, if there is one (blocking)"""
+        from models import AgentState as StoredAgentState
         
-        return WorkflowState(session_id=session_id)
+        try:
+            row = StoredAgentState.query.filter_by(session_id=session_id, agent_type=_STORED_WORKFLOW_TYPE).first()
+            if row is None or not row.state_data:
+                return None
+            return WorkflowState.deserialize(row.state_data)
+        except Exception as e:
+            self.logger.error("Error loading workflow for session %s: %s", session_id, e)
+            return None
+    
+    def _delete_saved_workflow_state(self, session_id: str) -> bool:
+        from app import db
+        from models import AgentState as StoredAgentState
+        
+        try:
+            deleted = StoredAgentState.query.filter_by(session_id=session_id, agent_type=_STORED_WORKFLOW_TYPE).delete()
+            db.session.commit()
+            return deleted > 0
+        except Exception as e:
+            db.session.rollback()
+            self.logger.error("Error deleting saved workflow for session %s: %s", session_id, e)
+            return False
     
-    async def get_workflow_status(self, session_id: str) -> Dict[str, Any]:
-        """Get status of a workflow"""
-        if session_id not in self.active_workflows:
+    async def get_workflow_status(self, session_id: str, full: bool = False) -> Dict[str, Any]:
+        """Get status of a workflow, optionally with the full serialized state"""
+        workflow_state = await self._find_workflow_state(session_id)
+        if workflow_state is None:
             return {
                 "status": "not_found",
                 "session_id": session_id
             }
         
-        workflow_state = self.active_workflows[session_id]
-        
-        return {
+        status = {
             "status": "active" if not workflow_state.is_complete else "complete",
             "session_id": session_id,
             "current_agent": workflow_state.current_agent,
             "iteration_count": workflow_state.iteration_count,
             "agent_count": len(workflow_state.agent_states),
-            "last_update": datetime.utcnow().isoformat()
+            "version": workflow_state.version,
+            "last_update": utc_now_iso()
         }
+        if full:
+            status["workflow_state"] = workflow_state.to_dict()
+        return status
     
     async def clear_workflow(self, session_id: str) -> bool:
-        """Clear a workflow from memory"""
-        if session_id in self.active_workflows:
-            del self.active_workflows[session_id]
-            self.logger.info(f"Cleared workflow for session: {session_id}")
-            return True
-        return False
+        """Clear a workflow from memory and from the database"""
+        cleared = self.active_workflows.pop(session_id, None) is not None
+        cleared = self._pending_saves.pop(session_id, None) is not None or cleared
+        cleared = await asyncio.to_thread(self._delete_saved_workflow_state, session_id) or cleared
+        if cleared:
+            self.logger.info("Cleared workflow for session: %s", session_id)
+        return cleared
+    
+    def _agent_types(self) -> List[str]:
+        return [*_SPECIALIST_CLASS_NAMES, "personal_assistant"]
+    
+    def _agent_capabilities(self, agent_type: str) -> List[str]:
+        """Capabilities of an agent, read from its class if it has not been built yet"""
+        agent = self.agents.get(agent_type)
+        if agent is not None:
+            return agent.get_capabilities()
+        return list(_specialist_class(agent_type).CAPABILITIES)
     
     def get_available_agents(self) -> List[Dict[str, Any]]:
-        """Get information about available agents"""
-        agent_info = []
-        
-        for agent_type, agent in self.agents.items():
-            info = {
-                "agent_type": agent_type,
-                "capabilities": agent.get_capabilities(),
-                "status": "active"
-            }
-            agent_info.append(info)
-        
-        return agent_info
+        """Get information about available agents (shared list; do not modify)"""
+        return self._agent_info
     
     async def health_check(self) -> Dict[str, Any]:
         """Check health of all services and agents"""
         health_status = {
             "workflow": "healthy",
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": utc_now_iso(),
             "services": {},
             "agents": {},
             "active_workflows": len(self.active_workflows)
         }
         
         # Check services
-        try:
-            bedrock_health = self.bedrock_service.health_check()
-            health_status["services"]["bedrock"] = bedrock_health
-        except Exception as e:
-            health_status["services"]["bedrock"] = {"status": "unhealthy", "error": str(e)}
-        
-        try:
-            perplexity_health = await self.perplexity_service.health_check()
-            health_status["services"]["perplexity"] = perplexity_health
-        except Exception as e:
-            health_status["services"]["perplexity"] = {"status": "unhealthy", "error": str(e)}
+        health_status["services"] = await self._check_services()
         
         # Check agents
-        for agent_type, agent in self.agents.items():
-            try:
-                health_status["agents"][agent_type] = {
-                    "status": "healthy",
-                    "capabilities_count": len(agent.get_capabilities())
-                }
-            except Exception as e:
-                health_status["agents"][agent_type] = {
-                    "status": "unhealthy", 
-                    "error": str(e)
-                }
+        for agent_type, capabilities_count in self._capability_counts.items():
+            health_status["agents"][agent_type] = {
+                "status": "healthy",
+                "capabilities_count": capabilities_count
+            }
         
         return health_status
+    
+    async def _check_services(self) -> Dict[str, Any]:
+        """Probe external services concurrently, reusing results for HEALTH_CHECK_TTL seconds"""
+        cached = self._service_health
+        if cached is not None and time.monotonic() - cached[0] < config.CONFIG.HEALTH_CHECK_TTL:
+            return cached[1]
+        
+        bedrock_health, perplexity_health = await asyncio.gather(
+            asyncio.to_thread(self.bedrock_service.health_check),
+            self.perplexity_service.health_check(),
+            return_exceptions=True
+        )
+        
+        services = {}
+        for name, health in (("bedrock", bedrock_health), ("perplexity", perplexity_health)):
+            if isinstance(health, Exception):
+                health = {"status": "unhealthy", "error": str(health)}
+            services[name] = health
+        
+        self._service_health = (time.monotonic(), services)
+        return services
+    
+    async def aclose(self):
+        """Release connections and worker processes held by the services (call at shutdown)"""
+        if "perplexity_service" in self.__dict__:
+            await self.perplexity_service.aclose()
+        await self.tools_service.aclose()
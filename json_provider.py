@@ -0,0 +1,25 @@
+"""
+Flask JSON provider backed by json_utils.
+
+Registered on the app in app.py so jsonify() and request.get_json() use
+orjson when it is installed, without changing any call sites.
+"""
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+import json_utils
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson when available"""
+
+    # Always emit compact JSON; pretty-printing in debug mode would force the
+    # slower stdlib path
+    compact = True
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return json_utils.dumps(obj, default=json_utils.default)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return json_utils.loads(s)
@@ -0,0 +1,66 @@
+"""
+JSON helpers shared across the application.
+
+Uses orjson (a C/Rust implementation that is several times faster than the
+standard library and serializes datetimes natively) when it is installed,
+and falls back to the stdlib json module otherwise, so orjson stays an
+optional speed-up rather than a hard dependency.
+"""
+import json
+from collections import deque
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Optional
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can catch
+# this regardless of which backend is active
+JSONDecodeError = json.JSONDecodeError
+
+
+# Conversions for values neither backend serializes natively (orjson already
+# handles datetimes and UUIDs, the stdlib does not), keyed by exact type
+_DEFAULT_CONVERTERS = {
+    datetime: datetime.isoformat,
+    date: date.isoformat,
+    time: time.isoformat,
+    UUID: str,
+    Decimal: str,
+    set: list,
+    frozenset: list,
+    deque: list,
+}
+
+
+def default(obj: Any) -> Any:
+    """default= hook: one dict lookup for known types, str() for anything else"""
+    converter = _DEFAULT_CONVERTERS.get(type(obj))
+    return converter(obj) if converter is not None else str(obj)
+
+
+def loads(data) -> Any:
+    """Parse JSON from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Serialize obj to UTF-8 encoded JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, default=default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """Serialize obj to a JSON string"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default).decode("utf-8")
+    return json.dumps(obj, default=default, separators=(",", ":"))
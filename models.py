@@ -1,9 +1,22 @@
 from datetime import datetime
 from app import db
+from sqlalchemy import inspect
 from sqlalchemy.sql import func
 
+
+def _cached_dict(instance, stamp):
+    """Return the dict cached by to_dict if the row is unchanged since it was built"""
+    cached = getattr(instance, '_serialized', None)
+    if cached is not None and cached[0] == stamp and not inspect(instance).modified:
+        return cached[1]
+    return None
+
 class CalendarEvent(db.Model):
     __tablename__ = 'calendar_events'
+    __table_args__ = (
+        # Covers the start/end range predicate used for conflict checks
+        db.Index('ix_events_start_end', 'start_time', 'end_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -12,11 +25,17 @@ class CalendarEvent(db.Model):
     end_time = db.Column(db.DateTime, nullable=False)
     location = db.Column(db.String(200))
     all_day = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=func.now())
-    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+    created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now())
+    updated_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
     
     def to_dict(self):
-        return {
+        """Serialize the event; the result is cached and shared until the row changes"""
+        updated_at = self.updated_at
+        cached = _cached_dict(self, updated_at)
+        if cached is not None:
+            return cached
+        
+        data = {
             'id': self.id,
             'title': self.title,
             'description': self.description,
@@ -25,44 +44,65 @@ class CalendarEvent(db.Model):
             'location': self.location,
             'all_day': self.all_day,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'updated_at': updated_at.isoformat()
         }
+        self._serialized = (updated_at, data)
+        return data
+    
+    @classmethod
+    def bulk_to_dict(cls, events):
+        return [event.to_dict() for event in events]
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(100), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=func.now())
+    created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now())
     
     # Relationship to messages
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # Session history is read in timestamp order
+        db.Index('ix_msg_session_ts', 'session_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(100), db.ForeignKey('chat_sessions.session_id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
     agent_type = db.Column(db.String(50))  # Which agent handled this message
-    timestamp = db.Column(db.DateTime, default=func.now())
+    timestamp = db.Column(db.DateTime, default=func.now(), server_default=func.now())
     
     def to_dict(self):
-        return {
+        """Serialize the message; the result is cached and shared until the row changes"""
+        timestamp = self.timestamp
+        cached = _cached_dict(self, timestamp)
+        if cached is not None:
+            return cached
+        
+        data = {
             'id': self.id,
             'session_id': self.session_id,
             'role': self.role,
             'content': self.content,
             'agent_type': self.agent_type,
-            'timestamp': self.timestamp.isoformat()
+            'timestamp': timestamp.isoformat()
         }
+        self._serialized = (timestamp, data)
+        return data
 
 class AgentState(db.Model):
     __tablename__ = 'agent_states'
+    __table_args__ = (
+        db.Index('ix_agent_states_session_agent', 'session_id', 'agent_type'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(100), nullable=False)
     agent_type = db.Column(db.String(50), nullable=False)
     state_data = db.Column(db.Text)  # JSON serialized state
-    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+    updated_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
@@ -1,20 +1,56 @@
 import asyncio
+import atexit
+import functools
 import logging
-from flask import Blueprint, request, jsonify, session
+import threading
+from typing import Optional
+from flask import Blueprint, current_app, request, jsonify, session
 from graph.workflow import MultiAgentWorkflow
 import uuid
+import config
 
-api_bp = Blueprint('api', __name__)
+logger = logging.getLogger(__name__)
 
-# Initialize the workflow (this will be shared across requests)
-workflow = None
+api_bp = Blueprint('api', __name__)
 
+@functools.cache
 def get_workflow():
-    """Get or initialize the workflow instance"""
-    global workflow
-    if workflow is None:
-        workflow = MultiAgentWorkflow()
-    return workflow
+    """Get the workflow instance shared across requests (created eagerly at app startup)"""
+    return MultiAgentWorkflow()
+
+# One event loop, running in a background thread, serves every request so
+# connection pools and background tasks survive between requests
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, name="api-event-loop", daemon=True).start()
+
+@atexit.register
+def _close_workflow():
+    """Close the workflow's connections and workers on the loop that owns them"""
+    if get_workflow.cache_info().currsize:
+        try:
+            asyncio.run_coroutine_threadsafe(get_workflow().aclose(), _loop).result(timeout=5)
+        except Exception as e:
+            logger.warning("Failed to close workflow resources: %s", e)
+
+async def _with_app_context(app, coro):
+    with app.app_context():
+        return await coro
+
+def run_async(coro, timeout: Optional[float] = config.CONFIG.AGENT_TIMEOUT):
+    """Run a coroutine on the shared event loop and wait for its result
+    
+    Coroutines must not block: database work goes through asyncio.to_thread
+    so one slow query does not stall every other request on the loop.
+    timeout=None waits for as long as the coroutine takes.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        _with_app_context(current_app._get_current_object(), coro), _loop
+    )
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
 
 @api_bp.route('/chat', methods=['POST'])
 def chat():
@@ -43,15 +79,9 @@ def chat():
         
         # Process the message through the workflow
         workflow_instance = get_workflow()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            result = loop.run_until_complete(
-                workflow_instance.process_user_input(user_message, session_id)
-            )
-        finally:
-            loop.close()
+        # No cap here: a model call may legitimately take longer than
+        # AGENT_TIMEOUT once Bedrock's own retries and read timeout are counted
+        result = run_async(workflow_instance.process_user_input(user_message, session_id), timeout=None)
         
         if result.get('success'):
             agent_result = result.get('result', {})
@@ -64,7 +94,8 @@ def chat():
                 "metadata": {
                     "timestamp": agent_result.get('timestamp'),
                     "delegated_to": agent_result.get('delegated_to'),
-                    "action_performed": agent_result.get('action_performed')
+                    "action_performed": agent_result.get('action_performed'),
+                    "state_version": result.get('workflow_delta', {}).get('version')
                 }
             }
             
@@ -83,7 +114,7 @@ def chat():
             }), 500
             
     except Exception as e:
-        logging.error(f"Error in chat endpoint: {str(e)}")
+        logger.error("Error in chat endpoint: %s", e)
         return jsonify({
             "success": False,
             "error": f"Internal server error: {str(e)}"
@@ -94,20 +125,13 @@ def workflow_status(session_id):
     """Get workflow status"""
     try:
         workflow_instance = get_workflow()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            status = loop.run_until_complete(
-                workflow_instance.get_workflow_status(session_id)
-            )
-        finally:
-            loop.close()
+        full = request.args.get('full', '').lower() in ('1', 'true')
+        status = run_async(workflow_instance.get_workflow_status(session_id, full=full))
         
         return jsonify(status)
         
     except Exception as e:
-        logging.error(f"Error getting workflow status: {str(e)}")
+        logger.error("Error getting workflow status: %s", e)
         return jsonify({
             "error": str(e)
         }), 500
@@ -125,7 +149,7 @@ def get_agents():
         })
         
     except Exception as e:
-        logging.error(f"Error getting agents: {str(e)}")
+        logger.error("Error getting agents: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -136,20 +160,12 @@ def health_check():
     """Comprehensive health check"""
     try:
         workflow_instance = get_workflow()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            health = loop.run_until_complete(
-                workflow_instance.health_check()
-            )
-        finally:
-            loop.close()
+        health = run_async(workflow_instance.health_check())
         
         return jsonify(health)
         
     except Exception as e:
-        logging.error(f"Error in health check: {str(e)}")
+        logger.error("Error in health check: %s", e)
         return jsonify({
             "status": "unhealthy",
             "error": str(e)
@@ -160,15 +176,7 @@ def clear_session(session_id):
     """Clear a specific session"""
     try:
         workflow_instance = get_workflow()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            success = loop.run_until_complete(
-                workflow_instance.clear_workflow(session_id)
-            )
-        finally:
-            loop.close()
+        success = run_async(workflow_instance.clear_workflow(session_id))
         
         return jsonify({
             "success": success,
@@ -176,7 +184,7 @@ def clear_session(session_id):
         })
         
     except Exception as e:
-        logging.error(f"Error clearing session: {str(e)}")
+        logger.error("Error clearing session: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
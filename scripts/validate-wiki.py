@@ -4,18 +4,119 @@ Wiki Documentation Validator
 Validates the integrity and completeness of wiki documentation files.
 """
 
+import json
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import FrozenSet, List, Dict, NamedTuple, Optional, Set, Tuple
+
+# Markdown link [text](target) to another page; external (http/https) and
+# anchor (#...) links are skipped by the regex itself
+_LINK_RE = re.compile(r'\[([^\]]+)\]\((?!https?://|#)([^)]+)\)')
+# Opening/closing code fence and its language tag
+_CODE_BLOCK_RE = re.compile(r'```(\w*)')
+
+# Key topics that should be mentioned across files
+_CROSS_REF_CHECKS = {
+    "Installation": ["Home.md", "User-Guide.md", "Development-Guide.md"],
+    "Configuration": ["Installation.md", "Development-Guide.md", "Security-Guidelines.md"],
+    "API": ["Home.md", "User-Guide.md", "Development-Guide.md"],
+    "Security": ["Configuration.md", "Development-Guide.md", "Troubleshooting.md"]
+}
+# Finds every cross-reference topic in a single pass over a file
+_TOPIC_RE = re.compile("|".join(re.escape(topic) for topic in _CROSS_REF_CHECKS), re.IGNORECASE)
+
+# Navigation links the Home page should contain, found the same way
+_HOME_NAV_LINKS = ["Installation", "User-Guide", "API-Reference", "System-Architecture", "Development-Guide"]
+_NAV_RE = re.compile("|".join(re.escape(link) for link in _HOME_NAV_LINKS))
+
+class FileScan(NamedTuple):
+    """Everything the checks need from one markdown file"""
+    length: int
+    stripped_length: int
+    topics: FrozenSet[str]  # lowercased cross-reference topics mentioned
+    links: List[Tuple[str, str]]  # internal links only
+    has_title: bool
+    unnamed_code_blocks: int
+    nav_links: FrozenSet[str]  # _HOME_NAV_LINKS entries mentioned (case-sensitive)
+
+def _scan_file(path: Path) -> FileScan:
+    """Read a markdown file and do its per-file parsing (runs in a worker thread)"""
+    content = path.read_text(encoding='utf-8')
+    head = content[:4096]
+    return FileScan(
+        length=len(content),
+        stripped_length=len(content.strip()),
+        topics=frozenset(match.group(0).lower() for match in _TOPIC_RE.finditer(content)),
+        links=_LINK_RE.findall(content),
+        # Title (H1 header) near the top of the file
+        has_title=head.startswith('# ') or '\n# ' in head,
+        unnamed_code_blocks=sum(1 for language in _CODE_BLOCK_RE.findall(content) if not language),
+        nav_links=frozenset(_NAV_RE.findall(content))
+    )
+
+def _scan_to_json(scan: FileScan) -> list:
+    return [scan.length, scan.stripped_length, sorted(scan.topics), scan.links, scan.has_title, scan.unnamed_code_blocks,
+            sorted(scan.nav_links)]
+
+def _scan_from_json(data: list) -> FileScan:
+    length, stripped_length, topics, links, has_title, unnamed_code_blocks, nav_links = data
+    return FileScan(length, stripped_length, frozenset(topics), [tuple(link) for link in links], has_title, unnamed_code_blocks,
+                    frozenset(nav_links))
+
+class ScanCache:
+    """
+    Scans of unchanged files, persisted between runs (opt-in via --cache).
+    
+    Entries are keyed by absolute path and only reused while the file's
+    mtime and size are unchanged; anything unreadable is treated as empty.
+    """
+    VERSION = 2
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.dirty = False
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+            self._files = data["files"] if data.get("version") == self.VERSION else {}
+        except (OSError, ValueError, KeyError, AttributeError):
+            self._files = {}
+    
+    def get(self, path: Path, stat: os.stat_result):
+        entry = self._files.get(str(path.resolve()))
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return _scan_from_json(entry["scan"])
+        return None
+    
+    def put(self, path: Path, stat: os.stat_result, scan: FileScan):
+        self._files[str(path.resolve())] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "scan": _scan_to_json(scan)
+        }
+        self.dirty = True
+    
+    def save(self):
+        if self.dirty:
+            self.path.write_text(json.dumps({"version": self.VERSION, "files": self._files}), encoding='utf-8')
+            self.dirty = False
 
 class WikiValidator:
-    def __init__(self, docs_dir: str = "docs"):
+    def __init__(self, docs_dir: str = "docs", verbose: bool = False, cache: ScanCache = None,
+                 max_errors: Optional[int] = None):
         self.docs_dir = Path(docs_dir)
+        self.verbose = verbose
+        self.cache = cache
+        self.max_errors = max_errors  # None lists every broken link
         self.errors = []
         self.warnings = []
         
+        # Markdown file name -> scan, read once and shared by all checks
+        self._scans: Dict[str, FileScan] = {}
+        
         # Required files for complete documentation
         self.required_files = {
             "Home.md": "Main wiki homepage",
@@ -31,14 +132,44 @@ class WikiValidator:
             "Troubleshooting.md": "Troubleshooting guide"
         }
     
+    def _markdown_files(self) -> Dict[str, FileScan]:
+        """Read and scan every markdown file in the docs directory once, in parallel."""
+        if not self._scans:
+            # One scandir pass; DirEntry caches the file type, so no extra stats
+            with os.scandir(self.docs_dir) as entries:
+                md_entries = sorted((entry for entry in entries
+                                     if entry.name.endswith('.md') and entry.is_file()),
+                                    key=lambda entry: entry.name)
+            
+            scans = {}
+            to_scan = []
+            for entry in md_entries:
+                path = Path(entry.path)
+                cached = self.cache.get(path, entry.stat()) if self.cache else None
+                if cached is not None:
+                    scans[entry.name] = cached
+                else:
+                    to_scan.append((entry, path))
+            
+            if to_scan:
+                with ThreadPoolExecutor(max_workers=min(32, len(to_scan))) as executor:
+                    fresh = list(executor.map(_scan_file, [path for _, path in to_scan]))
+                for (entry, path), scan in zip(to_scan, fresh):
+                    scans[entry.name] = scan
+                    if self.cache:
+                        self.cache.put(path, entry.stat(), scan)
+            
+            self._scans = {entry.name: scans[entry.name] for entry in md_entries}
+        return self._scans
+    
     def validate_file_existence(self) -> None:
         """Check that all required documentation files exist."""
-        print("Validating file existence...")
+        self._progress("Validating file existence...")
         
+        files = self._markdown_files()
         missing_files = []
         for filename, description in self.required_files.items():
-            file_path = self.docs_dir / filename
-            if not file_path.exists():
+            if filename not in files:
                 missing_files.append(f"{filename} - {description}")
         
         if missing_files:
@@ -46,96 +177,76 @@ class WikiValidator:
             for file in missing_files:
                 self.errors.append(f"  - {file}")
         else:
-            print("✓ All required files present")
+            self._progress("✓ All required files present")
     
     def validate_internal_links(self) -> None:
         """Check for broken internal links between documentation pages."""
-        print("Validating internal links...")
+        self._progress("Validating internal links...")
         
         # Get all existing markdown files
-        existing_files = {f.stem for f in self.docs_dir.glob("*.md")}
-        broken_links = []
+        files = self._markdown_files()
+        # Interned, as are link targets below, so matches compare by identity
+        existing_files = {sys.intern(Path(name).stem) for name in files}
         
-        for md_file in self.docs_dir.glob("*.md"):
-            content = md_file.read_text(encoding='utf-8')
-            
-            # Find markdown links [text](target)
-            link_pattern = r'\[([^\]]+)\]\(([^)]+)\)'
-            links = re.findall(link_pattern, content)
-            
-            for link_text, link_target in links:
-                # Skip external links (http/https)
-                if link_target.startswith(('http://', 'https://')):
-                    continue
-                
-                # Skip anchor links
-                if link_target.startswith('#'):
-                    continue
-                
-                # Check if target file exists (remove .md extension if present)
-                target_file = link_target.replace('.md', '')
-                if target_file not in existing_files:
-                    broken_links.append(f"{md_file.name}: [{link_text}]({link_target})")
-        
-        if broken_links:
+        def broken_links():
+            for filename, scan in files.items():
+                for link_text, link_target in scan.links:
+                    # Check if target file exists (remove a trailing .md extension if present)
+                    target_file = sys.intern(link_target.removesuffix('.md'))
+                    if target_file not in existing_files:
+                        yield filename, link_text, link_target
+        
+        # Only the first max_errors links are listed; the rest are just counted
+        broken = broken_links()
+        shown = list(islice(broken, self.max_errors))
+        more = sum(1 for _ in broken)
+        
+        if shown or more:
             self.errors.append("Broken internal links found:")
-            for link in broken_links:
-                self.errors.append(f"  - {link}")
+            for filename, link_text, link_target in shown:
+                self.errors.append(f"  - {filename}: [{link_text}]({link_target})")
+            if more:
+                self.errors.append(f"  ... and {more} more broken links")
         else:
-            print("✓ All internal links valid")
+            self._progress("✓ All internal links valid")
     
     def validate_content_structure(self) -> None:
         """Validate that files have proper structure and content."""
-        print("Validating content structure...")
+        self._progress("Validating content structure...")
         
         structure_issues = []
         
-        for md_file in self.docs_dir.glob("*.md"):
-            content = md_file.read_text(encoding='utf-8')
-            lines = content.split('\n')
-            
+        for filename, scan in self._markdown_files().items():
             # Check for title (H1 header)
-            has_title = any(line.startswith('# ') for line in lines[:10])
-            if not has_title:
-                structure_issues.append(f"{md_file.name}: Missing H1 title")
+            if not scan.has_title:
+                structure_issues.append(f"{filename}: Missing H1 title")
             
             # Check minimum content length
-            if len(content.strip()) < 500:
-                self.warnings.append(f"{md_file.name}: Very short content ({len(content)} chars)")
+            if scan.stripped_length < 500:
+                self.warnings.append(f"{filename}: Very short content ({scan.length} chars)")
             
             # Check for code blocks without language specification
-            code_blocks = re.findall(r'```(\w*)', content)
-            unnamed_blocks = [block for block in code_blocks if not block]
-            if unnamed_blocks:
-                self.warnings.append(f"{md_file.name}: {len(unnamed_blocks)} code blocks without language specification")
+            if scan.unnamed_code_blocks:
+                self.warnings.append(f"{filename}: {scan.unnamed_code_blocks} code blocks without language specification")
         
         if structure_issues:
             self.errors.append("Content structure issues:")
             for issue in structure_issues:
                 self.errors.append(f"  - {issue}")
         else:
-            print("✓ Content structure valid")
+            self._progress("✓ Content structure valid")
     
     def validate_cross_references(self) -> None:
         """Check that important topics are cross-referenced appropriately."""
-        print("Validating cross-references...")
-        
-        # Key topics that should be mentioned across files
-        cross_ref_checks = {
-            "Installation": ["Home.md", "User-Guide.md", "Development-Guide.md"],
-            "Configuration": ["Installation.md", "Development-Guide.md", "Security-Guidelines.md"],
-            "API": ["Home.md", "User-Guide.md", "Development-Guide.md"],
-            "Security": ["Configuration.md", "Development-Guide.md", "Troubleshooting.md"]
-        }
+        self._progress("Validating cross-references...")
         
         missing_refs = []
+        files = self._markdown_files()
         
-        for topic, should_mention_in in cross_ref_checks.items():
+        for topic, should_mention_in in _CROSS_REF_CHECKS.items():
             for filename in should_mention_in:
-                file_path = self.docs_dir / filename
-                if file_path.exists():
-                    content = file_path.read_text(encoding='utf-8').lower()
-                    if topic.lower() not in content:
+                if filename in files:
+                    if topic.lower() not in files[filename].topics:
                         missing_refs.append(f"{filename}: Should reference '{topic}'")
         
         if missing_refs:
@@ -143,65 +254,69 @@ class WikiValidator:
             for ref in missing_refs:
                 self.warnings.append(f"  - {ref}")
         else:
-            print("✓ Cross-references look good")
+            self._progress("✓ Cross-references look good")
     
     def validate_home_page(self) -> None:
         """Validate that the Home page has proper navigation structure."""
-        print("Validating Home page navigation...")
+        self._progress("Validating Home page navigation...")
         
-        home_file = self.docs_dir / "Home.md"
-        if not home_file.exists():
+        home = self._markdown_files().get("Home.md")
+        if home is None:
             self.errors.append("Home.md is missing")
             return
         
-        content = home_file.read_text(encoding='utf-8')
-        
-        # Check for navigation links to major sections
-        required_nav_links = [
-            "Installation", "User-Guide", "API-Reference", 
-            "System-Architecture", "Development-Guide"
-        ]
-        
-        missing_nav = []
-        for nav_item in required_nav_links:
-            if nav_item not in content:
-                missing_nav.append(nav_item)
+        # Check for navigation links to major sections (found by the single scan)
+        missing_nav = [nav_item for nav_item in _HOME_NAV_LINKS if nav_item not in home.nav_links]
         
         if missing_nav:
             self.warnings.append("Home page missing navigation links:")
             for item in missing_nav:
                 self.warnings.append(f"  - {item}")
         else:
-            print("✓ Home page navigation complete")
+            self._progress("✓ Home page navigation complete")
+    
+    def _progress(self, message: str) -> None:
+        """Per-check progress line, only shown with --verbose"""
+        if self.verbose:
+            print(message)
     
     def generate_report(self) -> None:
         """Generate validation report."""
-        print("\n" + "="*60)
-        print("WIKI DOCUMENTATION VALIDATION REPORT")
-        print("="*60)
+        # Built up front and written in one go
+        out = [
+            "\n" + "="*60,
+            "WIKI DOCUMENTATION VALIDATION REPORT",
+            "="*60
+        ]
         
         if not self.errors and not self.warnings:
-            print("✅ All validation checks passed!")
-            print("Your documentation is ready for GitHub wiki.")
+            out.append("✅ All validation checks passed!")
+            out.append("Your documentation is ready for GitHub wiki.")
+            self._write(out)
             return
         
         if self.errors:
-            print("\n🚨 ERRORS (must be fixed):")
-            for error in self.errors:
-                print(f"   {error}")
+            out.append("\n🚨 ERRORS (must be fixed):")
+            out.extend(f"   {error}" for error in self.errors)
         
         if self.warnings:
-            print("\n⚠️  WARNINGS (recommended to fix):")
-            for warning in self.warnings:
-                print(f"   {warning}")
+            out.append("\n⚠️  WARNINGS (recommended to fix):")
+            out.extend(f"   {warning}" for warning in self.warnings)
         
-        print(f"\nSummary: {len(self.errors)} errors, {len(self.warnings)} warnings")
+        out.append(f"\nSummary: {len(self.errors)} errors, {len(self.warnings)} warnings")
         
         if self.errors:
-            print("\nPlease fix all errors before setting up the wiki.")
+            out.append("\nPlease fix all errors before setting up the wiki.")
+            self._write(out)
             sys.exit(1)
         else:
-            print("\nDocumentation is ready! Warnings are optional improvements.")
+            out.append("\nDocumentation is ready! Warnings are optional improvements.")
+            self._write(out)
+    
+    @staticmethod
+    def _write(lines: List[str]) -> None:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
     
     def run_validation(self) -> None:
         """Run all validation checks."""
@@ -218,21 +333,38 @@ class WikiValidator:
         self.validate_cross_references()
         self.validate_home_page()
         
+        if self.cache:
+            self.cache.save()
+        
         self.generate_report()
 
 def main():
     """Main entry point."""
     import argparse
     
+    def non_negative_int(value: str) -> int:
+        number = int(value)
+        if number < 0:
+            raise argparse.ArgumentTypeError(f"must be 0 or more, got {number}")
+        return number
+    
     parser = argparse.ArgumentParser(description="Validate wiki documentation")
     parser.add_argument("--docs-dir", default="docs", 
                        help="Documentation directory (default: docs)")
     parser.add_argument("--verbose", action="store_true",
                        help="Show detailed validation output")
+    parser.add_argument("--cache", nargs="?", const=".wiki-validate-cache.json",
+                       help="Reuse scans of unchanged files from this cache file "
+                            "(default when given without a path: .wiki-validate-cache.json)")
+    
+    parser.add_argument("--max-errors", type=non_negative_int, metavar="N",
+                       help="List at most N broken links (the rest are counted)")
     
     args = parser.parse_args()
     
-    validator = WikiValidator(args.docs_dir)
+    validator = WikiValidator(args.docs_dir, verbose=args.verbose,
+                              cache=ScanCache(args.cache) if args.cache else None,
+                              max_errors=args.max_errors)
     validator.run_validation()
 
 if __name__ == "__main__":
@@ -1,9 +1,135 @@
-import json
+import asyncio
+import functools
+import hashlib
 import logging
+import random
+import threading
+import time
 import boto3
-from typing import List, Dict, Any, Optional
+from botocore.config import Config as BotoConfig
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Optional
 from botocore.exceptions import ClientError, NoCredentialsError
 import config
+import json_utils
+
+# Claude expects "user" and "assistant" roles
+_CLAUDE_ROLES = frozenset(("user", "assistant"))
+
+def _base_claude_body(max_tokens: int, temperature: float) -> Dict[str, Any]:
+    # Prepare the request body for Claude 3.5 Sonnet v4
+    # Enhanced parameters for improved performance and capabilities
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": 0.95,  # Enhanced token sampling for better quality
+        "top_k": 50,    # Optimized for Claude 3.5 Sonnet v4
+        "messages": []
+    }
+
+def _plain_messages_key(messages: List[Dict[str, Any]]) -> Optional[tuple]:
+    """Hashable (role, content) pairs for a plain-text conversation, or None if any content is structured"""
+    key = []
+    for message in messages:
+        role = message.get("role", "user")
+        if role not in _CLAUDE_ROLES:
+            continue
+        content = message.get("content", "")
+        if not isinstance(content, str):
+            return None
+        key.append((role, content))
+    return tuple(key)
+
+def _text_blocks_key(blocks: List[Dict[str, Any]]) -> Optional[tuple]:
+    """Hashable (text, cache_control type) pairs for plain text blocks, or None for anything richer"""
+    key = []
+    for block in blocks:
+        cache_control = block.get("cache_control")
+        if (block.get("type") != "text" or not isinstance(block.get("text"), str)
+                or block.keys() - {"type", "text", "cache_control"}
+                or (cache_control is not None and cache_control.keys() != {"type"})):
+            return None
+        key.append((block["text"], cache_control["type"] if cache_control else None))
+    return tuple(key)
+
+@functools.lru_cache(maxsize=1024)
+def _serialize_plain_body(system: Any, messages_key: tuple, max_tokens: int, temperature: float) -> bytes:
+    """JSON request body for a plain-text conversation, memoized for repeated prompts
+    
+    system is a system prompt string, or a _text_blocks_key tuple for a system
+    prompt given as text blocks (which may carry cache_control checkpoints).
+    """
+    body = _base_claude_body(max_tokens, temperature)
+    if isinstance(system, tuple):
+        body["system"] = [
+            {"type": "text", "text": text, "cache_control": {"type": cache_type}} if cache_type
+            else {"type": "text", "text": text}
+            for text, cache_type in system
+        ]
+    elif system:
+        body["system"] = system
+    body["messages"] = [{"role": role, "content": content} for role, content in messages_key]
+    return json_utils.dumps_bytes(body)
+
+# bedrock-runtime client shared by every BedrockService, so credentials,
+# endpoint resolution and the HTTPS connection pool are set up once per process
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+def _shared_client():
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = boto3.client(
+                'bedrock-runtime',
+                region_name=config.CONFIG.AWS_REGION,
+                aws_access_key_id=config.CONFIG.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=config.CONFIG.AWS_SECRET_ACCESS_KEY,
+                config=BotoConfig(
+                    # Enough pooled keep-alive connections that concurrent calls never queue on the pool
+                    max_pool_connections=max(50, config.CONFIG.BEDROCK_MAX_CONCURRENCY),
+                    retries={'mode': 'adaptive', 'max_attempts': 5},
+                    connect_timeout=3,
+                    read_timeout=60,
+                    tcp_keepalive=True
+                )
+            )
+        return _CLIENT
+
+# Control-plane client, only used for health checks (list_foundation_models
+# is not part of the bedrock-runtime API)
+_CONTROL_CLIENT = None
+
+def _shared_control_client():
+    global _CONTROL_CLIENT
+    with _CLIENT_LOCK:
+        if _CONTROL_CLIENT is None:
+            _CONTROL_CLIENT = boto3.client(
+                'bedrock',
+                region_name=config.CONFIG.AWS_REGION,
+                aws_access_key_id=config.CONFIG.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=config.CONFIG.AWS_SECRET_ACCESS_KEY,
+                config=BotoConfig(connect_timeout=3, read_timeout=10)
+            )
+        return _CONTROL_CLIENT
+
+# How long health check results are reused; failures are re-checked sooner
+_HEALTHY_TTL = 30.0  # seconds
+_UNHEALTHY_TTL = 5.0
+
+# Errors worth retrying after botocore gives up, and the backoff used for them
+_RETRYABLE_ERROR_CODES = frozenset((
+    "ThrottlingException", "ServiceUnavailableException",
+    "ModelTimeoutException", "ModelNotReadyException"
+))
+_RETRY_ATTEMPTS = 3
+_RETRY_BASE_DELAY = 0.2  # seconds
+_RETRY_MAX_DELAY = 8.0
+
+def _payload_key(payload: bytes) -> bytes:
+    return hashlib.blake2b(payload, digest_size=16).digest()
 
 class BedrockService:
     """
@@ -39,16 +165,36 @@ class BedrockService:
     def __init__(self):
         self.logger = logging.getLogger("services.bedrock")
         self.client = None
-        self.model_id = config.Config.BEDROCK_MODEL_ID
+        self.model_id = config.CONFIG.BEDROCK_MODEL_ID
+        self.region = config.CONFIG.AWS_REGION
+        self._is_claude = "claude" in self.model_id.lower()
+        self.disable_prompt_caching = config.CONFIG.DISABLE_PROMPT_CACHING
+        
+        # boto3 calls block, so they run on a bounded pool; this keeps the event
+        # loop free and lets concurrent agent tasks overlap their Bedrock calls
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.CONFIG.BEDROCK_MAX_CONCURRENCY,
+            thread_name_prefix="bedrock"
+        )
+        
+        # Identical request bodies already in flight share one Bedrock call.
+        # Executor futures (not asyncio ones) are used because callers may run
+        # on different event loops.
+        self._inflight: Dict[bytes, Future] = {}
+        self._inflight_lock = threading.Lock()
+        
+        # Opt-in cache of text responses, only ever used for temperature 0
+        # requests since those are the only ones expected to be repeatable
+        self._response_cache_ttl = config.CONFIG.BEDROCK_RESPONSE_CACHE_TTL
+        self._responses: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._responses_lock = threading.Lock()
+        
+        # (expires_at, result) of the last health check
+        self._last_health: Optional[tuple] = None
+        self._health_lock = threading.Lock()
         
         try:
-            # Initialize Bedrock client
-            self.client = boto3.client(
-                'bedrock-runtime',
-                region_name=config.Config.AWS_REGION,
-                aws_access_key_id=config.Config.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=config.Config.AWS_SECRET_ACCESS_KEY
-            )
+            self.client = _shared_client()
             self.logger.info(f"Bedrock client initialized with Claude 3.5 Sonnet v4 model: {self.model_id}")
             
         except NoCredentialsError:
@@ -63,18 +209,33 @@ class BedrockService:
         messages: List[Dict[str, str]], 
         system_prompt: Optional[str] = None,
         max_tokens: int = 1000,
-        temperature: float = 0.1
+        temperature: float = 0.1,
+        system_prompt_blocks: Optional[List[Dict[str, Any]]] = None,
+        stream: bool = False
     ) -> str:
-        """Generate a response using Amazon Bedrock"""
+        """Generate a response using Amazon Bedrock
+        
+        system_prompt_blocks, when given, takes precedence over system_prompt and
+        is sent as structured system content so blocks marked with cache_control
+        are reused from Bedrock's prompt cache across calls.
+        
+        With stream=True the text is read from the response stream chunk by
+        chunk instead of buffering and parsing one large response body, which
+        suits long outputs (large max_tokens).
+        """
         
         try:
+            if stream:
+                chunks = [chunk async for chunk in self.stream_response(messages, system_prompt, max_tokens, temperature, system_prompt_blocks)]
+                return "".join(chunks)
+            
             # Prepare the request body based on the model
-            if "claude" in self.model_id.lower():
-                return await self._generate_claude_response(messages, system_prompt, max_tokens, temperature)
+            if self._is_claude:
+                return await self._generate_claude_response(messages, system_prompt, max_tokens, temperature, system_prompt_blocks)
             else:
                 # Default to Claude format, but log a warning
                 self.logger.warning(f"Using Claude format for unknown model: {self.model_id}")
-                return await self._generate_claude_response(messages, system_prompt, max_tokens, temperature)
+                return await self._generate_claude_response(messages, system_prompt, max_tokens, temperature, system_prompt_blocks)
                 
         except Exception as e:
             self.logger.error(f"Error generating response: {str(e)}")
@@ -85,55 +246,217 @@ class BedrockService:
         messages: List[Dict[str, str]],
         system_prompt: Optional[str] = None,
         max_tokens: int = 1000,
-        temperature: float = 0.1
+        temperature: float = 0.1,
+        system_prompt_blocks: Optional[List[Dict[str, Any]]] = None
     ) -> str:
         """Generate response using Claude 3.5 Sonnet v4 model format"""
         
+        payload = self._claude_payload(messages, system_prompt, max_tokens, temperature, system_prompt_blocks)
+        
+        cache_key = None
+        if temperature == 0 and self._response_cache_ttl > 0:
+            cache_key = _payload_key(payload)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                self.logger.debug("Bedrock response cache hit")
+                return cached
+        
+        response_body = await self._invoke_payload(payload)
+        
+        # Extract content from Claude response
+        if "content" in response_body and len(response_body["content"]) > 0:
+            text = response_body["content"][0].get("text", "")
+            if cache_key is not None:
+                self._cache_response(cache_key, text)
+            return text
+        else:
+            self.logger.warning("Unexpected response format from Claude model")
+            return "I apologize, but I couldn't generate a proper response."
+    
+    def _claude_payload(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str],
+        max_tokens: int,
+        temperature: float,
+        system_prompt_blocks: Optional[List[Dict[str, Any]]]
+    ) -> bytes:
+        """Serialized request body; plain-text conversations reuse a memoized serialization"""
+        messages_key = _plain_messages_key(messages)
+        if messages_key is not None:
+            # Agents send their system prompt as cacheable text blocks
+            system = _text_blocks_key(self._prepare_blocks(system_prompt_blocks)) if system_prompt_blocks else system_prompt
+            if system is not None or not system_prompt_blocks:
+                return _serialize_plain_body(system, messages_key, max_tokens, temperature)
+        return json_utils.dumps_bytes(self._build_claude_body(messages, system_prompt, max_tokens, temperature, system_prompt_blocks))
+    
+    def _cached_response(self, key: bytes) -> Optional[str]:
+        with self._responses_lock:
+            entry = self._responses.get(key)
+            if entry is None:
+                return None
+            expires_at, text = entry
+            if expires_at <= time.monotonic():
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+            return text
+    
+    def _cache_response(self, key: bytes, text: str):
+        with self._responses_lock:
+            self._responses[key] = (time.monotonic() + self._response_cache_ttl, text)
+            self._responses.move_to_end(key)
+            while len(self._responses) > 1024:
+                self._responses.popitem(last=False)
+    
+    async def generate_structured_response(
+        self,
+        messages: List[Dict[str, str]],
+        tool: Dict[str, Any],
+        system_prompt: Optional[str] = None,
+        max_tokens: int = 300,
+        temperature: float = 0.1,
+        system_prompt_blocks: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate structured output by forcing the model to call a single tool.
+        
+        `tool` is an Anthropic tool definition (name, description, input_schema).
+        The model is required to call it, and the tool input is returned as an
+        already-parsed dict that follows the schema, so callers never have to
+        parse free-form JSON out of a text reply.
+        """
+        body = self._build_claude_body(messages, system_prompt, max_tokens, temperature, system_prompt_blocks)
+        body["tools"] = [tool]
+        body["tool_choice"] = {"type": "tool", "name": tool["name"]}
+        
+        response_body = await self._invoke_claude(body)
+        
+        for block in response_body.get("content", []):
+            if block.get("type") == "tool_use" and block.get("name") == tool["name"]:
+                return block.get("input", {})
+        
+        self.logger.warning(f"Claude response did not include a '{tool['name']}' tool call")
+        raise Exception(f"Model did not return structured output for '{tool['name']}'")
+    
+    async def stream_response(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str] = None,
+        max_tokens: int = 1000,
+        temperature: float = 0.1,
+        system_prompt_blocks: Optional[List[Dict[str, Any]]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a response from Bedrock, yielding text chunks as they are generated.
+        
+        The blocking event stream is read on the executor and handed to the event
+        loop through a queue, so the first tokens reach the caller long before
+        the full completion is done. Closing the generator early stops the reader.
+        """
+        body = self._build_claude_body(messages, system_prompt, max_tokens, temperature, system_prompt_blocks)
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+        
+        def read_stream():
+            try:
+                response = self.client.invoke_model_with_response_stream(
+                    modelId=self.model_id,
+                    body=json_utils.dumps_bytes(body),
+                    contentType='application/json',
+                    accept='application/json'
+                )
+                stream = response['body']
+                try:
+                    for event in stream:
+                        if stop.is_set():
+                            break
+                        chunk = event.get('chunk')
+                        if not chunk:
+                            continue
+                        payload = json_utils.loads(chunk['bytes'])
+                        if payload.get('type') == 'content_block_delta':
+                            text = payload.get('delta', {}).get('text')
+                            if text:
+                                loop.call_soon_threadsafe(queue.put_nowait, text)
+                finally:
+                    stream.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+        
+        reader = loop.run_in_executor(self._executor, read_stream)
         try:
-            # Prepare the request body for Claude 3.5 Sonnet v4
-            # Enhanced parameters for improved performance and capabilities
-            body = {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": 0.95,  # Enhanced token sampling for better quality
-                "top_k": 50,    # Optimized for Claude 3.5 Sonnet v4
-                "messages": []
-            }
-            
-            # Add system prompt if provided
-            if system_prompt:
-                body["system"] = system_prompt
-            
-            # Convert messages to Claude format
-            for message in messages:
-                role = message.get("role", "user")
-                content = message.get("content", "")
-                
-                # Claude expects "user" and "assistant" roles
-                if role in ["user", "assistant"]:
-                    body["messages"].append({
-                        "role": role,
-                        "content": content
-                    })
-            
-            # Make the API call
-            response = self.client.invoke_model(
-                modelId=self.model_id,
-                body=json.dumps(body),
-                contentType='application/json',
-                accept='application/json'
-            )
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    self.logger.error(f"Error streaming Claude response: {str(item)}")
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            await asyncio.shield(reader)
+    
+    def _build_claude_body(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str],
+        max_tokens: int,
+        temperature: float,
+        system_prompt_blocks: Optional[List[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Build the Anthropic messages request body for Bedrock"""
+        body = _base_claude_body(max_tokens, temperature)
+        
+        # Add system prompt if provided
+        if system_prompt_blocks:
+            body["system"] = self._prepare_blocks(system_prompt_blocks)
+        elif system_prompt:
+            body["system"] = system_prompt
+        
+        # Convert messages to Claude format; structured content may carry
+        # cache_control checkpoints
+        prepare_blocks = self._prepare_blocks
+        body["messages"] = [
+            {"role": role, "content": prepare_blocks(content) if isinstance(content, list) else content}
+            for message in messages
+            for role in (message.get("role", "user"),)
+            if role in _CLAUDE_ROLES
+            for content in (message.get("content", ""),)
+        ]
+        
+        return body
+    
+    async def _invoke_claude(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a request body to Bedrock and return the parsed response body"""
+        return await self._invoke_payload(json_utils.dumps_bytes(body))
+    
+    async def _invoke_payload(self, payload: bytes) -> Dict[str, Any]:
+        """Send a serialized request body to Bedrock and return the parsed response body"""
+        try:
+            key = _payload_key(payload)
             
-            # Parse the response
-            response_body = json.loads(response['body'].read())
+            started = False
+            with self._inflight_lock:
+                future = self._inflight.get(key)
+                if future is None:
+                    # Make the API call off the event loop
+                    future = self._executor.submit(self._invoke_model, payload)
+                    self._inflight[key] = future
+                    started = True
+                else:
+                    self.logger.debug("Joining identical in-flight Bedrock request")
+            if started:
+                # Registered outside the lock: a call that already finished runs
+                # the callback immediately, and it takes the lock itself
+                future.add_done_callback(lambda done, key=key: self._forget_inflight(key, done))
             
-            # Extract content from Claude response
-            if "content" in response_body and len(response_body["content"]) > 0:
-                return response_body["content"][0].get("text", "")
-            else:
-                self.logger.warning("Unexpected response format from Claude model")
-                return "I apologize, but I couldn't generate a proper response."
+            # Shielded so one caller giving up does not cancel the call for the others
+            return await asyncio.shield(asyncio.wrap_future(future))
                 
         except ClientError as e:
             error_code = e.response['Error']['Code']
@@ -149,7 +472,7 @@ class BedrockService:
             else:
                 raise Exception(f"Bedrock API error: {error_message}")
                 
-        except json.JSONDecodeError as e:
+        except json_utils.JSONDecodeError as e:
             self.logger.error(f"Failed to parse Bedrock response: {str(e)}")
             raise Exception("Failed to parse response from Bedrock")
             
@@ -157,32 +480,83 @@ class BedrockService:
             self.logger.error(f"Unexpected error in Claude response generation: {str(e)}")
             raise
     
+    def _forget_inflight(self, key: bytes, future: Future):
+        """Drop a finished request from the in-flight table"""
+        with self._inflight_lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+    
+    def _invoke_model(self, body: bytes) -> Dict[str, Any]:
+        """Invoke the model and parse the response body (blocking; runs on the executor)
+        
+        Throttling and transient service errors that outlast botocore's own
+        adaptive retries are retried a few more times with exponential
+        backoff and full jitter, so concurrent callers spread out instead of
+        retrying in lockstep.
+        """
+        for attempt in range(_RETRY_ATTEMPTS):
+            try:
+                response = self.client.invoke_model(
+                    modelId=self.model_id,
+                    body=body,
+                    contentType='application/json',
+                    accept='application/json'
+                )
+                return json_utils.loads(response['body'].read())
+            except ClientError as e:
+                if attempt == _RETRY_ATTEMPTS - 1 or e.response['Error']['Code'] not in _RETRYABLE_ERROR_CODES:
+                    raise
+                delay = random.uniform(0, min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * 2 ** attempt))
+                self.logger.warning(f"Bedrock call failed with {e.response['Error']['Code']}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+    
+    def _prepare_blocks(self, blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Strip cache_control markers from content blocks when prompt caching is disabled"""
+        if not self.disable_prompt_caching:
+            return blocks
+        return [{k: v for k, v in block.items() if k != "cache_control"} for block in blocks]
+    
     def health_check(self) -> Dict[str, Any]:
-        """Check if the Bedrock service is accessible"""
-        try:
-            # Try to list available models as a health check
-            response = self.client.list_foundation_models()
+        """Check if the Bedrock service is accessible
+        
+        The result is reused for 30 seconds (5 after a failure), so frequent
+        liveness probes don't turn into a control-plane call each.
+        """
+        with self._health_lock:
+            if self._last_health is not None:
+                expires_at, result = self._last_health
+                if time.monotonic() < expires_at:
+                    return result
             
-            return {
-                "status": "healthy",
-                "model_id": self.model_id,
-                "region": config.Config.AWS_REGION,
-                "models_available": len(response.get('modelSummaries', []))
-            }
+            try:
+                # Try to list available models as a health check
+                response = _shared_control_client().list_foundation_models()
+                
+                result = {
+                    "status": "healthy",
+                    "model_id": self.model_id,
+                    "region": self.region,
+                    "models_available": len(response.get('modelSummaries', []))
+                }
+                ttl = _HEALTHY_TTL
+                
+            except Exception as e:
+                self.logger.error(f"Bedrock health check failed: {str(e)}")
+                result = {
+                    "status": "unhealthy",
+                    "error": str(e),
+                    "model_id": self.model_id,
+                    "region": self.region
+                }
+                ttl = _UNHEALTHY_TTL
             
-        except Exception as e:
-            self.logger.error(f"Bedrock health check failed: {str(e)}")
-            return {
-                "status": "unhealthy",
-                "error": str(e),
-                "model_id": self.model_id,
-                "region": config.Config.AWS_REGION
-            }
+            self._last_health = (time.monotonic() + ttl, result)
+            return result
     
     def get_model_info(self) -> Dict[str, Any]:
         """Get information about the current model"""
         return {
             "model_id": self.model_id,
-            "region": config.Config.AWS_REGION,
+            "region": self.region,
             "service": "Amazon Bedrock"
         }
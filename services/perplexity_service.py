@@ -1,18 +1,83 @@
 import asyncio
 import aiohttp
 import logging
-from typing import Dict, Any, List, Optional
+import random
+import statistics
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Any, List, Optional
 import config
+import json_utils
+
+# Token counts kept from a response's usage block
+_USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+# Adaptive request timeout bounds (seconds) and how often it is recomputed
+_MIN_TIMEOUT = 5.0
+_MAX_TIMEOUT = 60.0
+_MIN_LATENCY_SAMPLES = 20
+_TIMEOUT_REFRESH_EVERY = 16
+
+# Responses worth retrying, and how hard to try
+_RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+_MAX_ATTEMPTS = 4
+_MAX_RETRY_DELAY = 8.0  # seconds
+
+_NO_API_KEY_CONTENT = (
+    "I'm unable to perform web searches at the moment. Please provide your search query "
+    "and I'll do my best to help with the information I have."
+)
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """Seconds to wait before the next attempt, honouring a numeric Retry-After"""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), _MAX_RETRY_DELAY)
+        except ValueError:
+            pass  # HTTP-date form; fall back to backoff
+    return min(2 ** attempt, _MAX_RETRY_DELAY) * (0.5 + random.random() / 2)
 
 class PerplexityService:
     """Service for Perplexity API integration"""
     
     def __init__(self):
         self.logger = logging.getLogger("services.perplexity")
-        self.api_key = config.Config.PERPLEXITY_API_KEY
-        self.model = config.Config.PERPLEXITY_MODEL
+        self.api_key = config.CONFIG.PERPLEXITY_API_KEY
+        self.model = config.CONFIG.PERPLEXITY_MODEL
         self.base_url = "https://api.perplexity.ai/chat/completions"
         
+        # Constant parts of every request, built once
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        } if self.api_key else None
+        # Starts at 30s and then adapts to observed latency (see _record_latency)
+        self._timeout = aiohttp.ClientTimeout(total=30)
+        self._latencies: Deque[float] = deque(maxlen=64)
+        self._latency_samples = 0
+        self._payload_defaults = {
+            "model": self.model,
+            "top_p": 0.9,
+            "return_images": False,
+            "return_related_questions": False,
+            "search_recency_filter": "month",
+            "top_k": 0,
+            "stream": False,
+            "presence_penalty": 0,
+            "frequency_penalty": 1
+        }
+        
+        # Shared across searches so repeat requests reuse pooled HTTPS
+        # connections and cached DNS; created on first use
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Exact-match cache of successful results:
+        # (model, system_prompt, query, max_tokens, temperature) -> (expires_at, result)
+        self.cache_ttl = config.CONFIG.PERPLEXITY_CACHE_TTL
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._cache_size = 1024
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        
         if not self.api_key:
             self.logger.warning("Perplexity API key not found. Search functionality will be limited.")
     
@@ -21,74 +86,89 @@ class PerplexityService:
         query: str,
         system_prompt: Optional[str] = None,
         max_tokens: Optional[int] = 1000,
-        temperature: float = 0.2
+        temperature: float = 0.2,
+        use_cache: bool = True,
+        cache_ttl: Optional[float] = None
     ) -> Dict[str, Any]:
-        """Perform a search using Perplexity API"""
+        """Perform a search using Perplexity API
+        
+        Successful results are reused for identical requests for cache_ttl
+        seconds (PERPLEXITY_CACHE_TTL when not given), so callers that know how
+        fast an answer goes stale should pass it; use_cache=False always
+        queries the API.
+        """
         
         if not self.api_key:
             return {
                 "success": False,
                 "error": "Perplexity API key not configured",
-                "content": "I'm unable to perform web searches at the moment. Please provide your search query and I'll do my best to help with the information I have."
+                "content": _NO_API_KEY_CONTENT
             }
         
+        key = (self.model, system_prompt, query, max_tokens, temperature)
+        ttl = self.cache_ttl if cache_ttl is None else cache_ttl
+        cacheable = use_cache and ttl > 0
+        if cacheable:
+            cached = self._cached_result(key)
+            if cached is not None:
+                self.logger.debug("Perplexity result cache hit")
+                return cached
+        
+        # Identical requests already in flight share one API call
+        request = self._inflight.get(key)
+        if request is None or request.get_loop() is not asyncio.get_running_loop():
+            request = asyncio.ensure_future(self._request(query, system_prompt, max_tokens, temperature))
+            self._inflight[key] = request
+            request.add_done_callback(lambda done, key=key: self._forget_inflight(key, done))
+        else:
+            self.logger.debug("Joining identical in-flight Perplexity request")
+        
+        # Shielded so one caller giving up does not cancel the request for the others
+        result = await asyncio.shield(request)
+        if cacheable and result.get("success"):
+            self._cache_result(key, result, ttl)
+        return dict(result)
+    
+    def _forget_inflight(self, key: tuple, request: asyncio.Future):
+        if self._inflight.get(key) is request:
+            del self._inflight[key]
+    
+    async def _request(
+        self,
+        query: str,
+        system_prompt: Optional[str],
+        max_tokens: Optional[int],
+        temperature: float
+    ) -> Dict[str, Any]:
+        """Send one search request to the Perplexity API"""
         try:
-            # Prepare messages
-            messages = []
-            
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
+            body = json_utils.dumps_bytes(self._build_payload(query, system_prompt, max_tokens, temperature))
             
-            messages.append({
-                "role": "user", 
-                "content": query
-            })
-            
-            # Prepare request payload
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": 0.9,
-                "return_images": False,
-                "return_related_questions": False,
-                "search_recency_filter": "month",
-                "top_k": 0,
-                "stream": False,
-                "presence_penalty": 0,
-                "frequency_penalty": 1
-            }
-            
-            # Make the API request
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.base_url,
-                    json=payload,
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
+            # Make the API request, retrying rate limits and transient server
+            # errors with jittered exponential backoff (or the server's Retry-After)
+            for attempt in range(_MAX_ATTEMPTS):
+                started = time.perf_counter()
+                async with self._get_session().post(self.base_url, data=body, timeout=self._timeout) as response:
                     
                     if response.status == 200:
-                        data = await response.json()
+                        data = json_utils.loads(await response.read())
+                        self._record_latency(time.perf_counter() - started)
                         return self._parse_perplexity_response(data)
-                    else:
-                        error_text = await response.text()
-                        self.logger.error(f"Perplexity API error {response.status}: {error_text}")
-                        
-                        return {
-                            "success": False,
-                            "error": f"API request failed with status {response.status}",
-                            "content": "I encountered an error while searching for information. Please try again later."
-                        }
+                    
+                    error_text = await response.text()
+                    if response.status in _RETRYABLE_STATUSES and attempt < _MAX_ATTEMPTS - 1:
+                        delay = _retry_delay(attempt, response.headers.get("Retry-After"))
+                        self.logger.warning(f"Perplexity API returned {response.status}, retrying in {delay:.1f}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    
+                    self.logger.error(f"Perplexity API error {response.status}: {error_text}")
+                    
+                    return {
+                        "success": False,
+                        "error": f"API request failed with status {response.status}",
+                        "content": "I encountered an error while searching for information. Please try again later."
+                    }
                         
         except asyncio.TimeoutError:
             self.logger.error("Perplexity API request timed out")
@@ -106,10 +186,95 @@ class PerplexityService:
                 "content": "I encountered an error while searching. Please try rephrasing your query."
             }
     
+    def _build_payload(
+        self,
+        query: str,
+        system_prompt: Optional[str],
+        max_tokens: Optional[int],
+        temperature: float
+    ) -> Dict[str, Any]:
+        """Request payload for one search"""
+        # Prepare messages
+        messages = []
+        
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+        
+        messages.append({
+            "role": "user", 
+            "content": query
+        })
+        
+        return {
+            **self._payload_defaults,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+    
+    def _record_latency(self, seconds: float):
+        """Track successful request latency and periodically re-derive the timeout
+        
+        Once enough samples exist the timeout becomes 3x the rolling p95,
+        kept between 5 and 60 seconds, so a dead API is given up on sooner
+        while slow-but-normal responses are not cut off.
+        """
+        latencies = self._latencies
+        latencies.append(seconds)
+        self._latency_samples += 1
+        if len(latencies) >= _MIN_LATENCY_SAMPLES and self._latency_samples % _TIMEOUT_REFRESH_EVERY == 0:
+            p95 = statistics.quantiles(latencies, n=20)[-1]
+            total = min(max(_MIN_TIMEOUT, 3.0 * p95), _MAX_TIMEOUT)
+            self._timeout = aiohttp.ClientTimeout(total=total)
+    
+    def _cached_result(self, key: tuple) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return dict(result)
+    
+    def _cache_result(self, key: tuple, result: Dict[str, Any], ttl: float):
+        self._cache[key] = (time.monotonic() + ttl, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it on first use
+        
+        A session belongs to the event loop it was created on, so a new one is
+        made if that loop has since been closed. Creation never awaits, so no
+        lock is needed.
+        """
+        session = self._session
+        if session is None or session.closed or session.loop.is_closed():
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=30),
+                timeout=self._timeout,
+                headers=self._headers
+            )
+            self._session = session
+        return session
+    
+    async def aclose(self):
+        """Close the shared session and its pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
     def _parse_perplexity_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Parse the response from Perplexity API"""
         try:
-            choices = data.get('choices', [])
+            _get = data.get
+            choices = _get('choices')
             if not choices:
                 return {
                     "success": False,
@@ -117,22 +282,23 @@ class PerplexityService:
                     "content": "I didn't receive a proper response from the search service."
                 }
             
-            # Get the main response content
-            message = choices[0].get('message', {})
-            content = message.get('content', '')
-            
-            # Get citations if available
-            citations = data.get('citations', [])
+            # The schema is fixed, so index straight into the main response
+            # content and only fall back when a level is missing
+            try:
+                content = choices[0]['message']['content']
+            except KeyError:
+                content = ''
             
-            # Get usage information
-            usage = data.get('usage', {})
+            # Keep only the token counts: results are cached, and the rest of
+            # the usage block is never read
+            usage = _get('usage') or {}
             
             return {
                 "success": True,
                 "content": content,
-                "citations": citations,
-                "usage": usage,
-                "model": data.get('model', self.model)
+                "citations": _get('citations', []),
+                "usage": {field: usage[field] for field in _USAGE_FIELDS if field in usage},
+                "model": _get('model', self.model)
             }
             
         except Exception as e:
@@ -157,7 +323,8 @@ class PerplexityService:
             result = await self.search(
                 "What is 2+2?",
                 system_prompt="Respond with just the answer.",
-                max_tokens=50
+                max_tokens=50,
+                use_cache=False
             )
             
             if result.get('success'):
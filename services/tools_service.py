@@ -1,10 +1,180 @@
+import asyncio
+import atexit
+import hashlib
+import re
 import subprocess
-import tempfile
+import struct
+import sys
+import threading
+import time
 import os
+import stat
+import uuid
 import logging
-import json
-from typing import Dict, Any, Optional
-from datetime import datetime
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import json_utils
+
+# Commands run_shell_command refuses to run, anywhere in the command and in
+# any case; whitespace between words may vary
+_DANGEROUS_COMMAND_RE = re.compile(r"rm\s+-rf|sudo|passwd|chmod\s+777|dd\s+if=", re.IGNORECASE)
+
+# System directories edit_file refuses to touch, anywhere in the given path
+_DANGEROUS_PATH_RE = re.compile("|".join(map(re.escape, ('/etc/', '/usr/', '/bin/', '/sbin/', '/root/'))))
+
+# Snippets whose output is cached may only import these modules and must not
+# use anything that reads outside state, varies between runs or has effects
+_PURE_MODULES = frozenset((
+    'math', 'cmath', 'statistics', 'decimal', 'fractions', 'itertools', 'functools',
+    'operator', 'collections', 'string', 're', 'json', 'textwrap', 'heapq', 'bisect'
+))
+_IMPORT_RE = re.compile(r"^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w.,\s]+?)\s*(?:[#;]|$))", re.MULTILINE)
+# set/frozenset iterate in hash order, which changes with string hash
+# randomization whenever the worker restarts; object() and dunder attributes
+# (__subclasses__, __dict__, ...) expose addresses and interpreter state
+_IMPURE_NAMES_RE = re.compile(
+    r"\b(?:open|input|eval|exec|compile|__import__|breakpoint|globals|locals|vars|id|hash|getattr|setattr"
+    r"|object|set|frozenset)\b|__\w+__"
+)
+# Default reprs print a memory address ("<Foo object at 0x7f...>")
+_ADDRESS_MARKER = " at 0x"
+_PYTHON_RESULT_CACHE_SIZE = 256
+
+def _is_deterministic_snippet(code: str) -> bool:
+    """Conservative check that a snippet's output depends only on its source
+    
+    A heuristic, not a proof. Set literals and set comprehensions are not
+    detected, and neither is code that reads module state left behind by an
+    earlier snippet in the same worker (e.g. an attribute set on an imported
+    module). run_python also refuses to cache output that shows a memory
+    address.
+    """
+    if _IMPURE_NAMES_RE.search(code):
+        return False
+    for match in _IMPORT_RE.finditer(code):
+        if match.group(1):
+            modules = [match.group(1)]
+        else:
+            modules = [name.split()[0] for name in match.group(2).split(',') if name.strip()]
+        if any(module.split('.')[0] not in _PURE_MODULES for module in modules):
+            return False
+    # Any import the pattern did not understand (e.g. inside a statement) disqualifies
+    return code.count('import') == len(_IMPORT_RE.findall(code))
+
+# Journal entries are buffered and written at most this long after being added
+_JOURNAL_FLUSH_DELAY = 0.5  # seconds
+_JOURNAL_BUFFER_SIZE = 1 << 16  # bytes; a fuller buffer is written immediately
+
+# Frames between run_python and its worker: 4-byte big-endian length + payload
+_FRAME_HEADER = struct.Struct(">I")
+
+# Long-lived interpreter behind run_python. It reads length-prefixed code
+# frames on stdin and answers each with a length-prefixed JSON result on a
+# private copy of its stdout. While a snippet runs, file descriptors 1 and 2
+# point at temporary files, so output from print() and from child processes
+# is captured alike.
+_PYTHON_WORKER_SRC = r"""
+import json, os, struct, sys, tempfile, traceback
+
+header = struct.Struct(">I")
+frames_in = os.fdopen(os.dup(0), "rb")
+frames_out = os.fdopen(os.dup(1), "wb")
+devnull = os.open(os.devnull, os.O_RDONLY)
+os.dup2(devnull, 0)
+out_file = tempfile.TemporaryFile()
+err_file = tempfile.TemporaryFile()
+os.dup2(out_file.fileno(), 1)
+os.dup2(err_file.fileno(), 2)
+
+def captured(f):
+    f.seek(0)
+    return f.read().decode("utf-8", "replace")
+
+while True:
+    size = frames_in.read(header.size)
+    if len(size) < header.size:
+        break
+    code = frames_in.read(header.unpack(size)[0]).decode("utf-8")
+    for f in (out_file, err_file):
+        f.seek(0)
+        f.truncate()
+    return_code = 0
+    try:
+        exec(compile(code, "<python_repl>", "exec"), {"__name__": "__main__", "__builtins__": __builtins__})
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            return_code = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.stderr)
+            return_code = 1
+    except BaseException:
+        exc_type, exc, tb = sys.exc_info()
+        traceback.print_exception(exc_type, exc, tb.tb_next)
+        return_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    result = json.dumps({"output": captured(out_file), "error": captured(err_file), "return_code": return_code}).encode()
+    frames_out.write(header.pack(len(result)) + result)
+    frames_out.flush()
+"""
+
+# Blocking file I/O helpers, run through asyncio.to_thread so disk access
+# never stalls the event loop
+
+def _read_text(path: str) -> str:
+    """Read a UTF-8 file into a buffer sized from fstat, then decode once"""
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        buf = bytearray(size)
+        view = memoryview(buf)
+        offset = 0
+        while offset < size:
+            count = f.readinto(view[offset:])
+            if not count:
+                break
+            offset += count
+        view.release()
+        del buf[offset:]
+        # Pick up anything appended since the stat
+        buf += f.read()
+    text = buf.decode('utf-8')
+    # Same newline handling as text mode
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def _write_text(path: str, content: str, mode: str = 'w'):
+    if mode == 'a':
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(content)
+        return
+    
+    # Create directory if it doesn't exist
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    # Encode once and write straight to a temporary file next to the target,
+    # then swap it in, so readers never see a half-written file
+    data = memoryview(content.encode('utf-8'))
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        try:
+            # Keep the permissions of the file being replaced
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
 class ToolsService:
     """Service for built-in tools: python_repl, editor, shell, journal"""
@@ -12,40 +182,85 @@ class ToolsService:
     def __init__(self):
         self.logger = logging.getLogger("services.tools")
         self.journal_file = "assistant_journal.txt"
+        # Directory edit_file is confined to, resolved once
+        self._cwd_root = os.path.join(os.path.realpath(os.getcwd()), "")
+        
+        # Worker interpreter for run_python, plus the loop it and its lock belong to
+        self._python_worker: Optional[asyncio.subprocess.Process] = None
+        self._python_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._python_lock_obj: Optional[asyncio.Lock] = None
+        
+        # Results of deterministic snippets, keyed by a hash of the code
+        self._python_results: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        
+        # Journal entries waiting to be appended, the O_APPEND descriptor they
+        # go to and the pending flush, if any
+        self._journal_pending: List[bytes] = []
+        self._journal_pending_size = 0
+        # Guards the buffer and descriptor: the atexit hook runs on the main
+        # thread while the event loop thread may be flushing
+        self._journal_lock = threading.RLock()
+        self._journal_fd: Optional[int] = None
+        self._journal_flush: Optional[asyncio.TimerHandle] = None
+        self._journal_atexit = False
+        # Local (year, day of year) and its "YYYY-MM-DD" prefix for timestamps
+        self._journal_date = ((0, 0), "")
         
     async def run_python(self, code: str, timeout: int = 30) -> Dict[str, Any]:
-        """Execute Python code using python_repl equivalent"""
+        """Execute Python code using python_repl equivalent
+        
+        Snippets run one at a time on a long-lived worker interpreter, so
+        only the first call pays for interpreter start-up. Each snippet gets
+        fresh globals, but imported modules, the working directory and
+        environment changes persist in the worker until it is restarted
+        (after a timeout or crash).
+        """
+        cache_key = None
+        if _is_deterministic_snippet(code):
+            cache_key = hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+            cached = self._python_results.get(cache_key)
+            if cached is not None:
+                self._python_results.move_to_end(cache_key)
+                return dict(cached)
+        
         try:
-            # Create a temporary file for the Python code
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(code)
-                temp_file = f.name
+            # One deadline covers queueing for the worker as well as running the
+            # snippet, so a caller behind k others doesn't wait k x timeout
+            async with asyncio.timeout(timeout):
+                async with self._python_lock():
+                    worker = await self._python_worker_process()
+                    try:
+                        result = await self._exchange(worker, code)
+                    except asyncio.IncompleteReadError:
+                        # The snippet took the worker down with it (e.g. os._exit)
+                        return_code = await worker.wait()
+                        self._python_worker = None
+                        return {
+                            "success": False,
+                            "output": "",
+                            "error": f"Python worker exited unexpectedly with code {return_code}",
+                            "return_code": return_code
+                        }
+                    except BaseException:
+                        # This caller's own snippet timed out or was cancelled
+                        # mid-exchange; the worker running it can't be reused.
+                        # Giving up while still queued never gets here.
+                        self._kill_python_worker(worker)
+                        raise
             
-            try:
-                # Execute the Python code
-                result = subprocess.run(
-                    ['python3', temp_file],
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout,
-                    cwd=os.getcwd()
-                )
-                
-                return {
-                    "success": result.returncode == 0,
-                    "output": result.stdout,
-                    "error": result.stderr if result.returncode != 0 else None,
-                    "return_code": result.returncode
-                }
-                
-            finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_file)
-                except OSError:
-                    pass
+            response = {
+                "success": result["return_code"] == 0,
+                "output": result["output"],
+                "error": result["error"] if result["return_code"] != 0 else None,
+                "return_code": result["return_code"]
+            }
+            if cache_key is not None and response["success"] and _ADDRESS_MARKER not in response["output"]:
+                self._python_results[cache_key] = response
+                while len(self._python_results) > _PYTHON_RESULT_CACHE_SIZE:
+                    self._python_results.popitem(last=False)
+            return dict(response)
                     
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
             self.logger.error("Python code execution timed out")
             return {
                 "success": False,
@@ -63,12 +278,120 @@ class ToolsService:
                 "return_code": -1
             }
     
+    def _python_lock(self) -> asyncio.Lock:
+        """Lock serializing snippets on the worker (asyncio locks belong to one loop)"""
+        loop = asyncio.get_running_loop()
+        if self._python_loop is not loop:
+            self._python_loop = loop
+            self._python_lock_obj = asyncio.Lock()
+            self._python_worker = None  # pipes of a worker started on another loop are unusable
+        return self._python_lock_obj
+    
+    async def _python_worker_process(self) -> asyncio.subprocess.Process:
+        """Return the running worker interpreter, starting one if needed"""
+        worker = self._python_worker
+        if worker is None or worker.returncode is not None:
+            worker = await asyncio.create_subprocess_exec(
+                sys.executable, "-u", "-c", _PYTHON_WORKER_SRC,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                cwd=os.getcwd()
+            )
+            self._python_worker = worker
+        return worker
+    
+    @staticmethod
+    async def _exchange(worker: asyncio.subprocess.Process, code: str) -> Dict[str, Any]:
+        """Send one length-prefixed code frame and read back its result frame"""
+        data = code.encode('utf-8')
+        worker.stdin.write(_FRAME_HEADER.pack(len(data)) + data)
+        await worker.stdin.drain()
+        (size,) = _FRAME_HEADER.unpack(await worker.stdout.readexactly(_FRAME_HEADER.size))
+        return json_utils.loads(await worker.stdout.readexactly(size))
+    
+    def _kill_python_worker(self, worker: asyncio.subprocess.Process):
+        if self._python_worker is worker:
+            self._python_worker = None
+        if worker.returncode is None:
+            worker.kill()
+    
+    def _journal_descriptor(self) -> int:
+        """Append-only descriptor for the journal, opened on first use"""
+        if self._journal_fd is None:
+            self._journal_fd = os.open(self.journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._journal_fd
+    
+    def _schedule_journal_flush(self):
+        if not self._journal_atexit:
+            # Don't lose buffered entries if the process exits without aclose()
+            atexit.register(self._close_journal)
+            self._journal_atexit = True
+        if self._journal_pending_size >= _JOURNAL_BUFFER_SIZE:
+            self._flush_journal()
+        elif self._journal_flush is None:
+            self._journal_flush = asyncio.get_running_loop().call_later(_JOURNAL_FLUSH_DELAY, self._flush_journal)
+    
+    def _flush_journal(self) -> bool:
+        """Write buffered journal entries to the file with one append (no fsync)
+        
+        Entries leave the buffer only once written. If the write fails the
+        error is logged, the unwritten part stays buffered for the next flush
+        and the descriptor is reopened then (the file may have been rotated).
+        """
+        with self._journal_lock:
+            if self._journal_flush is not None:
+                self._journal_flush.cancel()
+                self._journal_flush = None
+            if not self._journal_pending:
+                return True
+            data = memoryview(b"".join(self._journal_pending))
+            try:
+                fd = self._journal_descriptor()
+                while data:
+                    data = data[os.write(fd, data):]
+            except OSError as e:
+                self.logger.error(f"Failed to write journal entries, keeping {len(data)} bytes buffered: {str(e)}")
+                self._journal_pending = [bytes(data)]
+                self._journal_pending_size = len(data)
+                self._release_journal_descriptor()
+                return False
+            self._journal_pending.clear()
+            self._journal_pending_size = 0
+            return True
+    
+    def _release_journal_descriptor(self):
+        if self._journal_fd is not None:
+            try:
+                os.close(self._journal_fd)
+            except OSError:
+                pass
+            self._journal_fd = None
+    
+    def _close_journal(self, discard: bool = False):
+        """Flush (or with discard=True drop) buffered entries and close the descriptor"""
+        with self._journal_lock:
+            if discard:
+                self._journal_pending.clear()
+                self._journal_pending_size = 0
+            self._flush_journal()
+            self._release_journal_descriptor()
+    
+    async def aclose(self):
+        """Flush the journal and stop the Python worker interpreter"""
+        self._close_journal()
+        worker, self._python_worker = self._python_worker, None
+        if worker is not None and worker.returncode is None:
+            worker.stdin.close()
+            try:
+                await asyncio.wait_for(worker.wait(), 5)
+            except asyncio.TimeoutError:
+                worker.kill()
+    
     async def run_shell_command(self, command: str, timeout: int = 30) -> Dict[str, Any]:
         """Execute a shell command"""
         try:
             # Basic security check - restrict dangerous commands
-            dangerous_commands = ['rm -rf', 'sudo', 'passwd', 'chmod 777', 'dd if=']
-            if any(dangerous in command.lower() for dangerous in dangerous_commands):
+            if _DANGEROUS_COMMAND_RE.search(command):
                 return {
                     "success": False,
                     "output": "",
@@ -76,7 +399,9 @@ class ToolsService:
                     "return_code": -1
                 }
             
-            result = subprocess.run(
+            # Off the event loop, so other coroutines (and batched tools) keep running
+            result = await asyncio.to_thread(
+                subprocess.run,
                 command,
                 shell=True,
                 capture_output=True,
@@ -114,19 +439,18 @@ class ToolsService:
         """Edit a file (write, append, or read)"""
         try:
             # Security check - prevent access to sensitive files
-            dangerous_paths = ['/etc/', '/usr/', '/bin/', '/sbin/', '/root/']
-            if any(dangerous in file_path for dangerous in dangerous_paths):
+            if _DANGEROUS_PATH_RE.search(file_path):
                 return {
                     "success": False,
                     "error": "Access to this file path is restricted",
                     "operation": operation
                 }
             
-            # Ensure we're working in the current directory or subdirectories
-            safe_path = os.path.abspath(file_path)
-            current_dir = os.path.abspath(os.getcwd())
+            # Ensure we're working in the current directory or subdirectories;
+            # symlinks are resolved and the separator stops /app matching /app2
+            safe_path = os.path.realpath(file_path)
             
-            if not safe_path.startswith(current_dir):
+            if not (safe_path + os.sep).startswith(self._cwd_root):
                 return {
                     "success": False,
                     "error": "File path must be within the current directory",
@@ -141,8 +465,7 @@ class ToolsService:
                         "operation": operation
                     }
                 
-                with open(safe_path, 'r', encoding='utf-8') as f:
-                    file_content = f.read()
+                file_content = await asyncio.to_thread(_read_text, safe_path)
                 
                 return {
                     "success": True,
@@ -152,11 +475,7 @@ class ToolsService:
                 }
                 
             elif operation == "write":
-                # Create directory if it doesn't exist
-                os.makedirs(os.path.dirname(safe_path), exist_ok=True)
-                
-                with open(safe_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
+                await asyncio.to_thread(_write_text, safe_path, content)
                 
                 return {
                     "success": True,
@@ -166,8 +485,7 @@ class ToolsService:
                 }
                 
             elif operation == "append":
-                with open(safe_path, 'a', encoding='utf-8') as f:
-                    f.write(content)
+                await asyncio.to_thread(_write_text, safe_path, content, 'a')
                 
                 return {
                     "success": True,
@@ -192,15 +510,27 @@ class ToolsService:
                 "operation": operation
             }
     
+    def _journal_timestamp(self) -> str:
+        """Local "YYYY-MM-DD HH:MM:SS"; the date part is formatted once per day"""
+        now = time.localtime()
+        day = (now.tm_year, now.tm_yday)
+        if self._journal_date[0] != day:
+            self._journal_date = (day, time.strftime("%Y-%m-%d", now))
+        return f"{self._journal_date[1]} {now.tm_hour:02d}:{now.tm_min:02d}:{now.tm_sec:02d}"
+    
     async def journal_entry(self, entry: str, operation: str = "add") -> Dict[str, Any]:
         """Add entries to or read from the assistant journal"""
         try:
             if operation == "add":
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                timestamp = self._journal_timestamp()
                 journal_entry = f"[{timestamp}] {entry}\n"
                 
-                with open(self.journal_file, 'a', encoding='utf-8') as f:
-                    f.write(journal_entry)
+                # Buffered and appended in one write shortly after a burst of entries
+                data = journal_entry.encode('utf-8')
+                with self._journal_lock:
+                    self._journal_pending.append(data)
+                    self._journal_pending_size += len(data)
+                self._schedule_journal_flush()
                 
                 return {
                     "success": True,
@@ -210,6 +540,7 @@ class ToolsService:
                 }
                 
             elif operation == "read":
+                self._flush_journal()
                 if not os.path.exists(self.journal_file):
                     return {
                         "success": True,
@@ -218,8 +549,7 @@ class ToolsService:
                         "operation": operation
                     }
                 
-                with open(self.journal_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                content = await asyncio.to_thread(_read_text, self.journal_file)
                 
                 return {
                     "success": True,
@@ -228,6 +558,9 @@ class ToolsService:
                 }
                 
             elif operation == "clear":
+                # Close first so later entries don't go to the removed file;
+                # entries still buffered belong to the journal being cleared
+                self._close_journal(discard=True)
                 if os.path.exists(self.journal_file):
                     os.remove(self.journal_file)
                 
@@ -252,6 +585,36 @@ class ToolsService:
                 "operation": operation
             }
     
+    async def run_batch(self, specs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run independent tool operations concurrently.
+        
+        Each spec names a tool ("python_repl", "shell", "editor" or "journal")
+        plus that tool's keyword arguments, e.g.
+        {"tool": "shell", "command": "ls", "timeout": 10}. Results come back in
+        the order of specs, but the operations may run in any order, so only
+        batch operations that don't depend on each other. Python snippets
+        still run one at a time on the shared worker.
+        """
+        tools = {
+            "python_repl": self.run_python,
+            "shell": self.run_shell_command,
+            "editor": self.edit_file,
+            "journal": self.journal_entry
+        }
+        
+        async def run_one(spec: Dict[str, Any]) -> Dict[str, Any]:
+            args = dict(spec)
+            tool = tools.get(args.pop("tool", None))
+            if tool is None:
+                return {"success": False, "error": f"Unknown tool: {spec.get('tool')}"}
+            try:
+                return await tool(**args)
+            except TypeError as e:
+                return {"success": False, "error": f"Invalid arguments for {spec['tool']}: {str(e)}"}
+        
+        return await asyncio.gather(*(run_one(spec) for spec in specs))
+    
     def get_available_tools(self) -> Dict[str, Any]:
         """Get information about available tools"""
         return {